@@ -5,24 +5,64 @@ from plone.dexterity.schema import SCHEMA_CACHE
 from zope.component import adapter
 from zope.interface import implementer
 
+# number of portal_types whose assignable is kept
+ASSIGNABLES_SIZE = 1000
+
 
 @implementer(IBehaviorAssignable)
 @adapter(IDexterityContent)
 class DexterityBehaviorAssignable(object):
     """Support plone.behavior behaviors stored in the FTI
+
+    The behaviors only depend on the portal_type, so the registered adapter
+    factory ``behaviorAssignable`` returns one shared instance per
+    portal_type, which has no ``context``.
     """
 
-    def __init__(self, context):
+    context = None
+
+    def __init__(self, context=None, portal_type=None):
         self.context = context
+        if portal_type is None and context is not None:
+            portal_type = context.portal_type
+        self.portal_type = portal_type
 
     def supports(self, behavior_interface):
-        for behavior in self.enumerateBehaviors():
-            if behavior_interface in behavior.interface._implied:
-                return True
-        return False
+        if type(self).enumerateBehaviors.im_func is not _enumerateBehaviors:
+            # a subclass adds behaviors of its own
+            for behavior in self.enumerateBehaviors():
+                if behavior_interface in behavior.interface._implied:
+                    return True
+            return False
+        descriptor = SCHEMA_CACHE.descriptor(self.portal_type)
+        if descriptor is None:
+            return False
+        return behavior_interface in descriptor.behavior_interfaces
 
     def enumerateBehaviors(self):
         for behavior in SCHEMA_CACHE.behavior_registrations(
-            self.context.portal_type
+            self.portal_type
         ):
             yield behavior
+
+_enumerateBehaviors = DexterityBehaviorAssignable.enumerateBehaviors.im_func
+
+_assignables = {}
+
+
+@implementer(IBehaviorAssignable)
+@adapter(IDexterityContent)
+def behaviorAssignable(context):
+    """The shared DexterityBehaviorAssignable of the context's portal_type.
+    """
+    portal_type = getattr(context, 'portal_type', None)
+    try:
+        return _assignables[portal_type]
+    except KeyError:
+        pass
+    if len(_assignables) >= ASSIGNABLES_SIZE:
+        _assignables.clear()
+    return _assignables.setdefault(
+        portal_type,
+        DexterityBehaviorAssignable(portal_type=portal_type)
+    )
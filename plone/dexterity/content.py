@@ -18,6 +18,7 @@ from Products.CMFCore.interfaces import IMutableDublinCore
 from Products.CMFCore.interfaces import ITypeInformation
 from Products.CMFDynamicViewFTI.browserdefault import BrowserDefaultMixin
 from Products.CMFPlone.interfaces import IConstrainTypes
+from collections import OrderedDict
 from copy import deepcopy
 from plone.autoform.interfaces import READ_PERMISSIONS_KEY
 from plone.behavior.interfaces import IBehaviorAssignable
@@ -27,14 +28,18 @@ from plone.dexterity.interfaces import IDexterityContainer
 from plone.dexterity.interfaces import IDexterityContent
 from plone.dexterity.interfaces import IDexterityItem
 from plone.dexterity.schema import SCHEMA_CACHE
+from plone.dexterity.security import checkPermission
 from plone.dexterity.utils import all_merged_tagged_values_dict
 from plone.dexterity.utils import datify
+from plone.dexterity.utils import hasCustomAssignable
+from plone.dexterity.utils import hasDynamicBehaviors
 from plone.dexterity.utils import iterSchemata
 from plone.dexterity.utils import safe_unicode
 from plone.dexterity.utils import safe_utf8
 from plone.folder.ordered import CMFOrderedBTreeFolderBase
 from plone.uuid.interfaces import IAttributeUUID
 from plone.uuid.interfaces import IUUID
+from threading import RLock
 from zExceptions import Unauthorized
 from zope.annotation import IAttributeAnnotatable
 from zope.component import queryUtility
@@ -71,6 +76,109 @@ def _default_from_schema(context, schema, fieldname):
     return _marker
 
 
+class SpecificationCache(object):
+    """Bounded table of combined specifications shared by all instances of
+    a portal_type.
+
+    The key is ``(type descriptor, specification)``, where the
+    specification is the direct specification of the instance or the one
+    implemented by its class. The value is the combined specification and
+    whether another IBehaviorAssignable adapter than the stock one is
+    registered for it. Lookups take no lock; adding an entry evicts the
+    oldest one once the table is full. ``hits`` and ``rebuilds`` are
+    approximate counters for monitoring.
+    """
+
+    lock = RLock()
+
+    def __init__(self, size=1000):
+        self.size = size
+        self.clear()
+
+    def get(self, key):
+        entry = self.specs.get(key)
+        if entry is not None:
+            self.hits += 1
+        return entry
+
+    def set(self, key, entry):
+        with self.lock:
+            self.rebuilds += 1
+            while len(self.specs) >= self.size:
+                self.specs.popitem(last=False)
+            self.specs[key] = entry
+
+    def clear(self):
+        with self.lock:
+            self.specs = OrderedDict()
+            self.hits = 0
+            self.rebuilds = 0
+
+SPECIFICATION_CACHE = SpecificationCache()
+
+
+def clearSpecificationCache(registration, event):
+    """Forget the shared specifications when an IBehaviorAssignable adapter
+    is registered or unregistered, as they tell whether it is the stock one.
+    """
+    provided = registration.provided
+    if provided is not None and provided.isOrExtends(IBehaviorAssignable):
+        SPECIFICATION_CACHE.clear()
+
+
+def type_specification(descriptor, spec):
+    """The specification of instances of the type described by descriptor,
+    given their direct specification or the one implemented by their class.
+    """
+    return _type_entry(descriptor, spec)[0]
+
+
+def _type_entry(descriptor, spec):
+    # This calculation is expensive and called hundreds of times during
+    # each request, so all instances of a type share the result. A new
+    # descriptor is built whenever the type is invalidated, also within
+    # the transaction changing it, so specs of other types stay valid.
+    key = (descriptor, spec)
+    entry = SPECIFICATION_CACHE.get(key)
+    if entry is not None:
+        return entry
+
+    if descriptor.schema:
+        dynamically_provided = [descriptor.schema]
+    else:
+        dynamically_provided = []
+    dynamically_provided.extend(descriptor.subtypes)
+
+    if dynamically_provided:
+        dynamically_provided.append(spec)
+        all_spec = Implements(*dynamically_provided)
+    else:
+        # rare case if no schema nor behaviors with markers are set
+        all_spec = spec
+
+    # Whether the behaviors come from somewhere else than the FTI is
+    # decided once here, not on every attribute lookup.
+    entry = (all_spec, hasCustomAssignable(all_spec))
+    SPECIFICATION_CACHE.set(key, entry)
+    return entry
+
+
+def _type_descriptor(inst):
+    """The type descriptor of inst and whether its behaviors may differ
+    from the ones enabled in the FTI, see hasDynamicBehaviors.
+    """
+    base = aq_base(inst)
+    if getattr(base, '_dynamic_behaviors', False):
+        return None, True
+    descriptor = SCHEMA_CACHE.descriptor(getattr(base, 'portal_type', None))
+    if descriptor is None:
+        return None, hasDynamicBehaviors(inst)
+    spec = getattr(base, '__provides__', None)
+    if spec is None:
+        spec = implementedBy(base.__class__)
+    return descriptor, _type_entry(descriptor, spec)[1]
+
+
 class FTIAwareSpecification(ObjectSpecificationDescriptor):
     """A __providedBy__ decorator that returns the interfaces provided by
     the object, plus the schema interface set in the FTI.
@@ -101,19 +209,35 @@ class FTIAwareSpecification(ObjectSpecificationDescriptor):
         if portal_type is None:
             return spec
 
-        # Find the cached value. This calculation is expensive and called
-        # hundreds of times during each request, so we require a fast cache
+        if getattr(inst, '_dynamic_behaviors', False):
+            return self._instance_spec(inst, portal_type, direct_spec, spec)
+
+        descriptor = SCHEMA_CACHE.descriptor(portal_type)
+        if descriptor is None:
+            return spec
+
+        all_spec, dynamic = _type_entry(descriptor, spec)
+        if dynamic:
+            # a custom IBehaviorAssignable adapter is registered
+            return self._instance_spec(inst, portal_type, direct_spec, spec)
+        return all_spec
+
+    def _instance_spec(self, inst, portal_type, direct_spec, spec):
+        """Spec of content whose behaviors are bound on the instance rather
+        than the FTI. It depends on the IBehaviorAssignable adapter and is
+        cached on the instance.
+        """
+        # Find the cached value.
         cache = getattr(inst, '_v__providedBy__', None)
 
         # See if we have a current cache. Reasons to do this include:
         #
-        #  - The FTI was modified.
+        #  - The FTI was modified or invalidated, so it has a new descriptor.
         #  - The instance was modified and persisted since the cache was built.
         #  - The instance has a different direct specification.
         updated = (
             inst._p_mtime,
-            SCHEMA_CACHE.modified(portal_type),
-            SCHEMA_CACHE.invalidations,
+            SCHEMA_CACHE.descriptor(portal_type),
             hash(direct_spec)
         )
         if cache is not None and cache[:-1] == updated:
@@ -165,10 +289,30 @@ class AttributeValidator(Explicit):
 
         context = aq_parent(self)
 
-        # we may want to cache this based on the combined mod-times
-        # of fti and context, but even this is not save in the case someone
-        # decides to have behaviors bound on something different than context
-        # or fti, i.e. schemas for subtrees.
+        # Unless the behaviors of the content are bound on something different
+        # than the fti, i.e. schemas for subtrees, the read permissions and
+        # their titles are precompiled in the type descriptor.
+        descriptor, dynamic = _type_descriptor(context)
+        if dynamic:
+            return self._dynamic_check(name, context)
+
+        if descriptor is None:
+            return 1
+
+        titles = descriptor.read_permission_titles
+        if name not in titles:
+            return 1
+
+        title = titles[name]
+        if title is not None:
+            return checkPermission(title, context)
+
+        return 0
+
+    def _dynamic_check(self, name, context):
+        # this is a rather expensive call, because this is called for each
+        # unprotected attribute access and merges the tagged values of all
+        # schemata of the context
         protection_dict = all_merged_tagged_values_dict(
             iterSchemata(context),
             READ_PERMISSIONS_KEY
@@ -179,9 +323,7 @@ class AttributeValidator(Explicit):
 
         permission = queryUtility(IPermission, name=protection_dict[name])
         if permission is not None:
-            return getSecurityManager().checkPermission(
-                permission.title, context
-            )
+            return checkPermission(permission.title, context)
 
         return 0
 
@@ -256,6 +398,12 @@ class DexterityContent(DAVResourceMixin, PortalContent, PropertyManager,
     # portal_type is set by the add view and/or factory
     portal_type = None
 
+    # Set this to True in subclasses whose behaviors do not (only) come from
+    # the FTI. Schema information then is computed per instance instead of
+    # being shared per type. Registering another IBehaviorAssignable adapter
+    # than the stock one has the same effect, see hasDynamicBehaviors.
+    _dynamic_behaviors = False
+
     title = u''
     description = u''
     subject = ()
@@ -314,8 +462,23 @@ class DexterityContent(DAVResourceMixin, PortalContent, PropertyManager,
         if name.startswith('__') or name == '_v__providedBy__':
             raise AttributeError(name)
 
-        # attribute was not found; try to look it up in the schema and return
-        # a default
+        # attribute was not found; try to look it up in the schemata and
+        # return a default
+        descriptor, dynamic = _type_descriptor(self)
+        if dynamic:
+            value = self._dynamic_default(name)
+            if value is not _marker:
+                return value
+            raise AttributeError(name)
+
+        if descriptor is not None and name in descriptor.field_names:
+            return descriptor.defaults[name](self)
+
+        raise AttributeError(name)
+
+    def _dynamic_default(self, name):
+        """Default of content whose behaviors are bound on the instance
+        """
         value = _default_from_schema(
             self,
             SCHEMA_CACHE.get(self.portal_type),
@@ -336,8 +499,7 @@ class DexterityContent(DAVResourceMixin, PortalContent, PropertyManager,
                     )
                     if value is not _marker:
                         return value
-
-        raise AttributeError(name)
+        return _marker
 
     # Let __name__ and id be identical. Note that id must be ASCII in Zope 2,
     # but __name__ should be unicode. Note that setting the name to something
@@ -357,6 +519,19 @@ class DexterityContent(DAVResourceMixin, PortalContent, PropertyManager,
         """Returns the item's globally unique id."""
         return IUUID(self)
 
+    @security.protected(permissions.ModifyPortalContent)
+    def indexObject(self):
+        # createContentInContainerBulk indexes its new objects at the end
+        if getattr(aq_base(self), '_v_defer_indexing', False):
+            return
+        CMFCatalogAware.indexObject(self)
+
+    @security.protected(permissions.ModifyPortalContent)
+    def reindexObject(self, idxs=[]):
+        if getattr(aq_base(self), '_v_defer_indexing', False):
+            return
+        CMFCatalogAware.reindexObject(self, idxs)
+
     @security.private
     def notifyModified(self):
         """Update creators and modification_date.
@@ -674,12 +849,29 @@ class Container(
     setTitle = DexterityContent.setTitle
     Description = DexterityContent.Description
     setDescription = DexterityContent.setDescription
+    indexObject = DexterityContent.indexObject
+    reindexObject = DexterityContent.reindexObject
 
     def __init__(self, id=None, **kwargs):
         CMFOrderedBTreeFolderBase.__init__(self, id)
         DexterityContent.__init__(self, id, **kwargs)
 
     def __getattr__(self, name):
+        # Special and volatile names, like _v__providedBy__ asked for while
+        # the specification of the content is computed, cannot be a schema
+        # field. They go straight to the BTree before the behaviors are
+        # looked at.
+        if name.startswith('__') or name.startswith('_v_'):
+            return CMFOrderedBTreeFolderBase.__getattr__(self, name)
+
+        # So do other names that cannot be a schema field, e.g. the ids of
+        # children during traversal.
+        descriptor, dynamic = _type_descriptor(self)
+        if not dynamic and (
+            descriptor is None or name not in descriptor.field_names
+        ):
+            return CMFOrderedBTreeFolderBase.__getattr__(self, name)
+
         try:
             return DexterityContent.__getattr__(self, name)
         except AttributeError:
@@ -701,10 +893,7 @@ class Container(
             ids = [ids]
         for id in ids:
             item = self._getOb(id)
-            if not getSecurityManager().checkPermission(
-                permissions.DeleteObjects,
-                item
-            ):
+            if not checkPermission(permissions.DeleteObjects, item):
                 raise Unauthorized(
                     "Do not have permissions to remove this object"
                 )
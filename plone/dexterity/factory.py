@@ -2,47 +2,64 @@
 from persistent import Persistent
 from plone.dexterity.interfaces import IDexterityFTI
 from plone.dexterity.interfaces import IDexterityFactory
+from plone.dexterity.schema import SCHEMA_CACHE
 from plone.dexterity.utils import resolveDottedName
-from zope.component import getUtility
 from zope.component.factory import Factory
 from zope.interface import implementer
 from zope.interface.declarations import Implements
+from zope.interface.interfaces import ComponentLookupError
 
 
 @implementer(IDexterityFactory)
 class DexterityFactory(Persistent, Factory):
     """A factory for Dexterity content.
+
+    The content class and the interfaces of the type are kept in volatile
+    attributes and only looked up again when the ``klass`` or the schema of
+    the FTI change.
     """
 
     def __init__(self, portal_type):
         self.portal_type = portal_type
 
+    def _fti(self):
+        fti = SCHEMA_CACHE.lookup_fti(self.portal_type)
+        if fti is None:
+            raise ComponentLookupError(IDexterityFTI, self.portal_type)
+        return fti
+
+    def _constructor(self, dotted_name):
+        record = getattr(self, '_v_constructor', None)
+        if record is not None and record[0] == dotted_name:
+            return record[1]
+
+        klass = resolveDottedName(dotted_name)
+        if klass is None or not callable(klass):
+            raise ValueError(
+                "Content class %s set for type %s is not valid" %
+                (dotted_name, self.portal_type)
+            )
+        self._v_constructor = (dotted_name, klass)
+        return klass
+
     @property
     def title(self):
-        fti = getUtility(IDexterityFTI, name=self.portal_type)
-        return fti.title
+        return self._fti().title
 
     @property
     def description(self):
-        fti = getUtility(IDexterityFTI, name=self.portal_type)
-        return fti.description
+        return self._fti().description
 
     def __call__(self, *args, **kw):
-        fti = getUtility(IDexterityFTI, name=self.portal_type)
-
-        klass = resolveDottedName(fti.klass)
-        if klass is None or not callable(klass):
-            raise ValueError(
-                "Content class %s set for type %s is not valid" %
-                (fti.klass, self.portal_type)
-            )
+        dotted_name = self._fti().klass
+        klass = self._constructor(dotted_name)
 
         try:
             obj = klass(*args, **kw)
         except TypeError, e:
             raise ValueError(
                 "Error whilst constructing content for %s using class %s: %s"
-                % (self.portal_type, fti.klass, str(e))
+                % (self.portal_type, dotted_name, str(e))
             )
 
         # Set portal_type if not set, but avoid creating an instance variable
@@ -53,9 +70,20 @@ class DexterityFactory(Persistent, Factory):
         return obj
 
     def getInterfaces(self):
-        fti = getUtility(IDexterityFTI, name=self.portal_type)
-        spec = Implements(fti.lookupSchema())
+        descriptor = SCHEMA_CACHE.descriptor(self.portal_type)
+        if descriptor is None:
+            raise ComponentLookupError(IDexterityFTI, self.portal_type)
+        record = getattr(self, '_v_interfaces', None)
+        if record is not None and record[0] is descriptor:
+            return record[1]
+
+        schema = descriptor.schema
+        if schema is None:
+            # raises the error the descriptor swallowed
+            schema = self._fti().lookupSchema()
+        spec = Implements(schema)
         spec.__name__ = self.portal_type
+        self._v_interfaces = (descriptor, spec)
         return spec
 
     def __repr__(self):
@@ -1,23 +1,32 @@
 # -*- coding: utf-8 -*-
-from AccessControl import getSecurityManager
 from Acquisition import aq_base
+from App.config import getConfiguration
 from Products.CMFCore.interfaces import ISiteRoot
 from Products.CMFDynamicViewFTI import fti as base
+from collections import OrderedDict
+from copy import copy
 from plone.dexterity import utils
 from plone.dexterity.factory import DexterityFactory
 from plone.dexterity.interfaces import IDexterityFTI
 from plone.dexterity.interfaces import IDexterityFTIModificationDescription
+from plone.dexterity.schema import SCHEMA_CACHE
 from plone.dexterity.schema import SchemaInvalidatedEvent
+from plone.dexterity.schema import TRANSIENT_SCHEMA_CACHE
 from plone.dexterity.schema import portalTypeToSchemaName
+from plone.dexterity.security import checkPermission
 from plone.supermodel import loadString, loadFile
 from plone.supermodel.model import Model
 from plone.supermodel.utils import syncSchema
+from threading import RLock
 from zope.component import getAllUtilitiesRegisteredFor
 from zope.component import getUtility
 from zope.component import queryUtility
 from zope.component.interfaces import IFactory
 from zope.event import notify
 from zope.i18nmessageid import Message
+from zope.interface import directlyProvidedBy
+from zope.interface import directlyProvides
+from zope.interface.interface import InterfaceClass
 from zope.interface import implementer
 from zope.lifecycleevent import modified
 from zope.security.interfaces import IPermission
@@ -27,6 +36,158 @@ import os.path
 import plone.dexterity.schema
 
 
+class ModelCache(object):
+    """Bounded process wide cache of parsed models.
+
+    Models parsed from a ``model_source`` are keyed by the source and the
+    schema policy, so the source is parsed once until it changes. The cached
+    models are private: ``lookupModel`` returns the parsed model and keeps a
+    copy, and returns a new copy on every hit, so that callers may change
+    the model they got. Adding an entry evicts the least recently used one
+    once the cache is full; the warm up makes room for the models of all
+    types of a site, see ``reserve``. Models loaded from a snapshot are
+    kept in ``preloaded`` until they are looked up for the first time, so
+    they are never evicted before they are used. ``hits`` and ``misses``
+    are approximate counters for monitoring.
+
+    Models read from a ``model_file`` are kept in ``files`` with the
+    absolute path and the modification time and size of the file.
+    ``file_mode`` decides how changes of the file are noticed:
+
+    ``dev``
+        the file is read on every lookup;
+    ``stat``
+        the file is read again when its modification time or size change;
+    ``production``
+        the file is never looked at again after the first lookup.
+
+    If ``file_mode`` is None, it is taken from the configuration on the
+    first lookup, see ``configured_file_mode``.
+    """
+
+    lock = RLock()
+
+    def __init__(self, size=100, file_mode=None):
+        self.size = size
+        self.file_mode = file_mode
+        self.clear()
+
+    def get(self, key):
+        model = self.models.get(key)
+        if model is None:
+            model = self.preloaded.pop(key, None)
+            if model is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.set(key, model)
+            return model
+        self.hits += 1
+        with self.lock:
+            # move it behind the entries evicted first
+            if key in self.models:
+                self.models[key] = self.models.pop(key)
+        return model
+
+    def set(self, key, model):
+        with self.lock:
+            self.models.pop(key, None)
+            while len(self.models) >= self.size:
+                self.models.popitem(last=False)
+            self.models[key] = model
+
+    def preload(self, key, model):
+        with self.lock:
+            self.preloaded[key] = model
+
+    def reserve(self, count):
+        """Make room for count more models, so that the models of the types
+        of a site do not evict each other.
+        """
+        with self.lock:
+            self.size = max(self.size, len(self.models) + count)
+
+    def clear(self):
+        with self.lock:
+            self.models = OrderedDict()
+            self.preloaded = {}
+            # one entry per model file and policy, there is a limited number
+            # of those
+            self.files = {}
+            self.hits = 0
+            self.misses = 0
+
+MODEL_CACHE = ModelCache()
+
+FILE_MODES = ('dev', 'stat', 'production')
+
+
+def configured_file_mode():
+    """The file_mode of MODEL_CACHE as configured in zope.conf::
+
+        <product-config plone.dexterity>
+            model-file-mode production
+        </product-config>
+
+    If it is not configured, ``dev`` in debug mode and ``stat`` otherwise.
+    """
+    configuration = getConfiguration()
+    product_config = getattr(configuration, 'product_config', None)
+    config = (product_config or {}).get('plone.dexterity') or {}
+    file_mode = config.get('model-file-mode')
+    if file_mode in FILE_MODES:
+        return file_mode
+    if file_mode:
+        logging.warning('Ignoring unknown model-file-mode %r', file_mode)
+    if getattr(configuration, 'debug_mode', False):
+        return 'dev'
+    return 'stat'
+
+
+def _file_stamp(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime, stat.st_size)
+
+
+def _copyModel(model):
+    """A copy of model whose schemata, fields and tagged values can be
+    changed without changing model.
+    """
+    originals = set(model.schemata.values())
+    copies = {}
+
+    def copy_schema(schema):
+        if schema in copies:
+            return copies[schema]
+        bases = tuple(
+            copy_schema(base) if base in originals else base
+            for base in schema.__bases__
+        )
+        attrs = {}
+        for name in schema.names():
+            attr = attrs[name] = copy(schema[name])
+            attr.interface = None
+        new_schema = copies[schema] = InterfaceClass(
+            schema.__name__,
+            bases,
+            attrs,
+            schema.__doc__,
+            __module__=schema.__module__
+        )
+        for key in schema.getTaggedValueTags():
+            new_schema.setTaggedValue(key, copy(schema.queryTaggedValue(key)))
+        directlyProvides(new_schema, directlyProvidedBy(schema))
+        return new_schema
+
+    return Model(dict(
+        (schemaName, copy_schema(schema))
+        for schemaName, schema in model.schemata.items()
+    ))
+
+
 @implementer(IDexterityFTIModificationDescription)
 class DexterityFTIModificationDescription(object):
 
@@ -255,11 +416,18 @@ class DexterityFTI(base.DynamicViewTypeInformation):
     def lookupModel(self):
 
         if self.model_source:
-            return loadString(self.model_source, policy=self.schema_policy)
+            # The source itself is part of the key, so that a hash collision
+            # can never return the model of another source.
+            key = (self.model_source, self.schema_policy)
+            model = MODEL_CACHE.get(key)
+            if model is not None:
+                return _copyModel(model)
+            model = loadString(self.model_source, policy=self.schema_policy)
+            MODEL_CACHE.set(key, _copyModel(model))
+            return model
 
         elif self.model_file:
-            model_file = self._absModelFile()
-            return loadFile(model_file, reload=True, policy=self.schema_policy)
+            return self._lookupModelFile()
 
         elif self.schema:
             schema = self.lookupSchema()
@@ -287,6 +455,10 @@ class DexterityFTI(base.DynamicViewTypeInformation):
         new_value = getattr(self, id, None)
 
         if oldValue != new_value:
+            if id in ('klass', 'schema') and new_value:
+                # the new name may have failed to resolve before
+                utils.DOTTED_NAME_CACHE.invalidate(new_value)
+
             modified(self, DexterityFTIModificationDescription(id, oldValue))
 
             # Update meta_type from klass
@@ -306,12 +478,7 @@ class DexterityFTI(base.DynamicViewTypeInformation):
         if permission is None:
             return False
 
-        return bool(
-            getSecurityManager().checkPermission(
-                permission.title,
-                container
-            )
-        )
+        return bool(checkPermission(permission.title, container))
 
     #
     # Helper methods
@@ -325,6 +492,38 @@ class DexterityFTI(base.DynamicViewTypeInformation):
             permission_names.add(permission.id)
         return sorted(permission_names)
 
+    def _lookupModelFile(self):
+        file_mode = MODEL_CACHE.file_mode
+        if file_mode is None:
+            file_mode = MODEL_CACHE.file_mode = configured_file_mode()
+        if file_mode == 'dev':
+            model_file = self._absModelFile()
+            return loadFile(model_file, reload=True, policy=self.schema_policy)
+
+        key = (self.model_file, self.schema_policy)
+        entry = MODEL_CACHE.files.get(key)
+        if entry is None:
+            model_file = self._absModelFile()
+            stamp = _file_stamp(model_file)
+        elif file_mode == 'production':
+            MODEL_CACHE.hits += 1
+            return _copyModel(entry[2])
+        else:
+            model_file, old_stamp, model = entry
+            stamp = _file_stamp(model_file)
+            if stamp is not None and stamp == old_stamp:
+                MODEL_CACHE.hits += 1
+                return _copyModel(model)
+            if stamp is None:
+                # raises ValueError if the file is gone
+                model_file = self._absModelFile()
+
+        MODEL_CACHE.misses += 1
+        model = loadFile(model_file, reload=True, policy=self.schema_policy)
+        with MODEL_CACHE.lock:
+            MODEL_CACHE.files[key] = (model_file, stamp, _copyModel(model))
+        return model
+
     def _absModelFile(self):
         colons = self.model_file.count(':')
         model_file = self.model_file
@@ -431,6 +630,12 @@ def unregister(fti, old_name=None):
     site_manager.unregisterUtility(provided=IDexterityFTI, name=portal_type)
     unregister_factory(fti.factory, site_manager)
 
+    # Placeholder interfaces looked up while the type is gone
+    TRANSIENT_SCHEMA_CACHE.evict(
+        portal_type,
+        '/'.join(site.getPhysicalPath())[1:]
+    )
+
 
 def unregister_factory(factory_name, site_manager):
     """Helper method to unregister factories when unused by any dexterity
@@ -458,6 +663,7 @@ def ftiAdded(object, event):
     if not IDexterityFTI.providedBy(event.object):
         return
 
+    SCHEMA_CACHE.forget_fti(event.object.getId())
     register(event.object)
 
 
@@ -468,6 +674,7 @@ def ftiRemoved(object, event):
     if not IDexterityFTI.providedBy(event.object):
         return
 
+    SCHEMA_CACHE.forget_fti(event.object.getId())
     unregister(event.object)
 
 
@@ -483,6 +690,8 @@ def ftiRenamed(object, event):
        or event.oldName == event.newName:
         return
 
+    SCHEMA_CACHE.forget_fti(event.oldName)
+    SCHEMA_CACHE.forget_fti(event.newName)
     unregister(event.object, event.oldName)
     register(event.object)
 
@@ -139,6 +139,17 @@ class IDexterityContainer(IDexterityContent):
     """
 
 
+# Security
+class IMemoizePermissionChecks(Interface):
+    """Marker interface for requests which memoize permission checks.
+
+    Dexterity remembers the result of each permission check on its content
+    for the rest of such a request, keyed by user, permission and path of
+    the object. Provide it on the request, e.g. with a browser layer, to
+    opt in.
+    """
+
+
 # Events
 class IBegunEvent(IObjectEvent):
     """Base begun event
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""Name chooser for Dexterity containers, registered if plone.app.content is
+installed.
+"""
+from Acquisition import aq_base
+from Acquisition import aq_inner
+from plone.app.content.namechooser import ATTEMPTS
+from plone.app.content.namechooser import FILENAME_REGEX
+from plone.app.content.namechooser import NormalizingNameChooser
+from plone.dexterity.interfaces import IDexterityContainer
+from zope.component import adapter
+from zope.container.interfaces import INameChooser
+from zope.interface import implementer
+
+import re
+
+# number of names per container whose last suffix is remembered
+COUNTERS_SIZE = 1000
+
+
+@implementer(INameChooser)
+@adapter(IDexterityContainer)
+class DexterityNameChooser(NormalizingNameChooser):
+    """A NormalizingNameChooser which finds a free ``name-N`` in large
+    containers without trying all suffixes from 1.
+
+    The highest suffix in use for a name is found with one range scan of the
+    container's BTree, and remembered in a volatile attribute of the
+    container. Following names are tried from there on, so adding many
+    objects with the same title needs about two id checks per object. Gaps
+    in the suffixes are not filled.
+    """
+
+    def _getCheckId(self, object):
+        check_id = getattr(object, 'check_id', None)
+        if check_id is None:
+            parent = aq_inner(self.context)
+
+            def check_id(id, required):
+                return parent.hasObject(id)
+        return check_id
+
+    def _findUniqueName(self, name, object):
+        check_id = self._getCheckId(object)
+        if not check_id(name, required=1):
+            return name
+
+        base, ext = name, ''
+        m = FILENAME_REGEX.match(name)
+        if m is not None:
+            base = m.groups()[0]
+            ext = '.' + m.groups()[1]
+
+        container = aq_base(aq_inner(self.context))
+        counters = getattr(container, '_v_name_counters', None)
+        if counters is None or len(counters) >= COUNTERS_SIZE:
+            counters = container._v_name_counters = {}
+
+        key = (base, ext)
+        idx = counters.get(key)
+        if idx is None:
+            idx = self._lastSuffix(base, ext)
+
+        for attempt in range(ATTEMPTS):
+            idx += 1
+            new_name = "%s-%d%s" % (base, idx, ext)
+            if not check_id(new_name, required=1):
+                # the name is only taken once the object is added
+                counters[key] = idx - 1
+                return new_name
+
+        return super(DexterityNameChooser, self)._findUniqueName(
+            name,
+            object
+        )
+
+    def _lastSuffix(self, base, ext):
+        """The highest N of the ids ``base-N.ext`` in the container, or 0.
+        """
+        tree = getattr(aq_base(self.context), '_tree', None)
+        if tree is None:
+            return 0
+        try:
+            prefix = ('%s-' % base).encode('ascii')
+            ext = ext.encode('ascii')
+        except UnicodeError:
+            return 0
+        pattern = re.compile(
+            r'%s(\d+)%s$' % (re.escape(prefix), re.escape(ext))
+        )
+        last = 0
+        for id in tree.keys(prefix + '0', prefix + '9\xff'):
+            m = pattern.match(id)
+            if m is not None:
+                last = max(last, int(m.group(1)))
+        return last
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 from plone.dexterity.interfaces import IDexterityContent
+from plone.dexterity.utils import getTypeDescriptor
 from plone.dexterity.utils import iterSchemata
 from plone.rfc822.interfaces import IPrimaryField
 from plone.rfc822.interfaces import IPrimaryFieldInfo
@@ -14,13 +15,17 @@ class PrimaryFieldInfo(object):
 
     def __init__(self, context):
         self.context = context
-        primary = None
-        for i in iterSchemata(context):
-            fields = getFieldsInOrder(i)
-            for name, field in fields:
-                if IPrimaryField.providedBy(field):
-                    primary = (name, field)
-                    break
+        descriptor = getTypeDescriptor(context)
+        if descriptor is not None:
+            primary = descriptor.primary_field
+        else:
+            primary = None
+            for i in iterSchemata(context):
+                fields = getFieldsInOrder(i)
+                for name, field in fields:
+                    if IPrimaryField.providedBy(field):
+                        primary = (name, field)
+                        break
         if not primary:
             raise TypeError('Could not adapt', context, IPrimaryFieldInfo)
         self.fieldname, self.field = primary
@@ -1,29 +1,50 @@
 # -*- coding: utf-8 -*-
+from Acquisition import aq_base
+from BTrees.Length import Length
+from BTrees.OOBTree import OOBTree
 from Products.CMFCore.interfaces import ISiteRoot
+from collections import OrderedDict
+from copy import deepcopy
+from decimal import Decimal
+from persistent import Persistent
 from plone.alterego import dynamic
 from plone.alterego.interfaces import IDynamicObjectFactory
+from plone.autoform.interfaces import IFormFieldProvider
+from plone.autoform.interfaces import READ_PERMISSIONS_KEY
 from plone.behavior.interfaces import IBehavior
 from plone.behavior.registration import BehaviorRegistration
 from plone.dexterity.interfaces import IContentType
 from plone.dexterity.interfaces import IDexterityFTI
 from plone.dexterity.interfaces import IDexteritySchema
 from plone.dexterity.interfaces import ISchemaInvalidatedEvent
+from plone.rfc822.interfaces import IPrimaryField
 from plone.supermodel.parser import ISchemaPolicy
+from plone.supermodel.utils import mergedTaggedValueDict
 from plone.supermodel.utils import syncSchema
 from plone.synchronize import synchronized
 from threading import RLock
+from transaction.interfaces import IDataManager
+from weakref import WeakKeyDictionary
+from weakref import WeakValueDictionary
+from zope.annotation.interfaces import IAnnotations
 from zope.component import adapter
 from zope.component import getAllUtilitiesRegisteredFor
 from zope.component import getUtility
 from zope.component import queryUtility
+from zope.component.hooks import getSite
 from zope.dottedname.resolve import resolve
 from zope.interface import alsoProvides
 from zope.interface import implementer
 from zope.interface.interface import InterfaceClass
+from zope.schema import getFieldsInOrder
+from zope.schema.interfaces import IContextAwareDefaultFactory
+from zope.security.interfaces import IPermission
 
-import functools
+import datetime
 import logging
 import new
+import re
+import transaction
 
 log = logging.getLogger(__name__)
 
@@ -31,43 +52,230 @@ log = logging.getLogger(__name__)
 generated = dynamic.create('plone.dexterity.schema.generated')
 transient = new.module("transient")
 
-_MARKER = dict()
-
 
 def invalidate_cache(fti):
     fti._p_activate()
-    fti.__dict__.pop('_v_schema_get', None)
-    fti.__dict__.pop('_v_schema_behavior_registrations', None)
-    fti.__dict__.pop('_v_schema_subtypes', None)
-    fti.__dict__.pop('_v_schema_schema_interfaces', None)
-    fti.__dict__.pop('_v_schema_modified', None)
-    fti.__dict__.pop('_v_schema_behavior_schema_interfaces', None)
-
-
-def volatile(func):
-    @functools.wraps(func)
-    def decorator(self, portal_type):
-        """lookup fti from portal_type and cache
-        """
-        if IDexterityFTI.providedBy(portal_type):
-            fti = portal_type
+    fti.__dict__.pop('_v_schema_descriptor', None)
+
+
+def lookup_behavior_registrations(fti):
+    """Look up the behavior registrations for all behaviors enabled in
+    the fti.
+
+    returns a tuple with instances of
+    ``plone.behavior.registration.BehaviorRegistration``.
+    """
+    registrations = []
+    for behavior_name in fti.behaviors:
+        registration = queryUtility(IBehavior, name=behavior_name)
+        if registration is None:
+            # BBB - this case should be deprecated in v 3.0
+            log.warning(
+                'No behavior registration found for behavior named: "{0}"'
+                ' - trying fallback lookup..."'.format(
+                    behavior_name
+                )
+            )
+            try:
+                schema_interface = resolve(behavior_name)
+            except (ValueError, ImportError):
+                log.error(
+                    "Error resolving behavior {0}".format(
+                        behavior_name
+                    )
+                )
+                continue
+            registration = BehaviorRegistration(
+                title=behavior_name,
+                description="bbb fallback lookup",
+                interface=schema_interface,
+                marker=None,
+                factory=None
+            )
+        registrations.append(registration)
+    return tuple(registrations)
+
+
+# Default values of these types can be handed out without copying them
+IMMUTABLE_TYPES = frozenset([
+    type(None), bool, int, long, float, complex, str, unicode,
+    datetime.date, datetime.datetime, datetime.time, datetime.timedelta,
+    Decimal,
+])
+
+
+def is_immutable(value):
+    """Whether value can be shared without deepcopy.
+    """
+    if type(value) in IMMUTABLE_TYPES:
+        return True
+    if type(value) in (tuple, frozenset):
+        return all(is_immutable(item) for item in value)
+    return False
+
+
+class FieldDefault(object):
+    """Default value of a schema field for DexterityContent.__getattr__.
+
+    Static immutable defaults are returned as they are, other defaults are
+    copied. Context aware default factories are called with the context.
+    """
+
+    __slots__ = (
+        'name',
+        'schema',
+        'field',
+        'context_aware',
+        'immutable',
+        'value',
+    )
+
+    def __init__(self, name, schema, field):
+        self.name = name
+        self.schema = schema
+        self.field = field
+        default_factory = getattr(field, 'defaultFactory', None)
+        self.context_aware = IContextAwareDefaultFactory.providedBy(
+            default_factory
+        )
+        if default_factory is None:
+            self.value = field.default
+            self.immutable = is_immutable(self.value)
         else:
-            fti = queryUtility(IDexterityFTI, name=portal_type)
-        if fti is not None and self.cache_enabled:
-            key = '_v_schema_%s' % func.__name__
-            cache = getattr(fti, key, _MARKER)
-            if cache is not _MARKER:
-                mtime, value = cache
-                if fti._p_mtime == mtime:
-                    return value
+            # factories may return a different value on every call
+            self.value = None
+            self.immutable = False
+
+    def __call__(self, context):
+        if self.immutable:
+            return self.value
+        if self.context_aware:
+            return deepcopy(self.field.bind(context).default)
+        return deepcopy(self.field.default)
+
+
+class TypeDescriptor(object):
+    """Precompiled schema information of one portal_type.
 
-        value = func(self, fti)
+    Everything the schema cache knows about a type is computed from the FTI
+    in one pass when the descriptor is built. A descriptor is never changed
+    afterwards, so it can be shared between threads without locking. When
+    the FTI changes or the cache is invalidated, a new one is built.
+    """
 
-        if fti is not None and self.cache_enabled:
-            setattr(fti, key, (fti._p_mtime, value))
+    __slots__ = (
+        'portal_type',
+        'mtime',
+        'generation',
+        'schema',
+        'behavior_registrations',
+        'subtypes',
+        'behavior_schema_interfaces',
+        'behavior_interfaces',
+        'schema_interfaces',
+        'form_schemata',
+        'schemata',
+        'primary_field',
+        'read_permissions',
+        'read_permission_titles',
+        'defaults',
+        'field_names',
+    )
 
-        return value
-    return decorator
+    def __init__(self, fti, generation=0):
+        self.portal_type = fti.getId()
+        self.mtime = fti._p_mtime
+        self.generation = generation
+
+        # main schema
+        try:
+            self.schema = fti.lookupSchema()
+        except (AttributeError, ValueError, LookupError):
+            self.schema = None
+
+        # behaviors
+        self.behavior_registrations = lookup_behavior_registrations(fti)
+        subtypes = []
+        behavior_schema_interfaces = []
+        for registration in self.behavior_registrations:
+            marker = getattr(registration, 'marker', None)
+            if marker is not None:
+                subtypes.append(marker)
+            interface = getattr(registration, 'interface', None)
+            if interface:
+                behavior_schema_interfaces.append(interface)
+        self.subtypes = tuple(subtypes)
+        self.behavior_schema_interfaces = tuple(behavior_schema_interfaces)
+
+        # the behavior interfaces and all interfaces they extend, to answer
+        # IBehaviorAssignable.supports() with one set membership test
+        behavior_interfaces = set()
+        for interface in self.behavior_schema_interfaces:
+            behavior_interfaces.update(interface._implied)
+        self.behavior_interfaces = frozenset(behavior_interfaces)
+        self.schema_interfaces = (
+            (self.schema, ) + self.behavior_schema_interfaces
+        )
+
+        # form field providers of the behaviors
+        form_schemata = []
+        for interface in self.behavior_schema_interfaces:
+            form_schema = IFormFieldProvider(interface, None)
+            if form_schema is not None:
+                form_schemata.append(form_schema)
+        self.form_schemata = tuple(form_schemata)
+
+        # what iterSchemata yields: main schema plus form schemata
+        if self.schema:
+            self.schemata = (self.schema, ) + self.form_schemata
+        else:
+            self.schemata = self.form_schemata
+
+        # primary field: the first primary field of the last schema which
+        # has one wins
+        primary_field = None
+        for schema in self.schemata:
+            for name, field in getFieldsInOrder(schema):
+                if IPrimaryField.providedBy(field):
+                    primary_field = (name, field)
+                    break
+        self.primary_field = primary_field
+
+        # read permissions of all fields
+        read_permissions = {}
+        for schema in self.schemata:
+            read_permissions.update(
+                mergedTaggedValueDict(schema, READ_PERMISSIONS_KEY)
+            )
+        self.read_permissions = read_permissions
+
+        # titles of the read permissions, as checkPermission() wants them;
+        # None for permissions which are not registered
+        read_permission_titles = {}
+        for name, permission_id in read_permissions.items():
+            permission = queryUtility(IPermission, name=permission_id)
+            read_permission_titles[name] = getattr(permission, 'title', None)
+        self.read_permission_titles = read_permission_titles
+
+        # default values of all fields of the main schema and the behavior
+        # schemata; the first schema providing a field wins
+        defaults = {}
+        for schema in self.schema_interfaces:
+            if schema is None:
+                continue
+            for name, field in getFieldsInOrder(schema):
+                if name not in defaults:
+                    defaults[name] = FieldDefault(name, schema, field)
+        self.defaults = defaults
+
+        # names of all fields in all schemata, to answer attribute lookups of
+        # non-field names with one set membership test
+        self.field_names = frozenset(defaults)
+
+    def __setattr__(self, name, value):
+        if hasattr(self, name):
+            raise AttributeError('TypeDescriptor is immutable')
+        super(TypeDescriptor, self).__setattr__(name, value)
 
 
 class SchemaCache(object):
@@ -91,30 +299,111 @@ class SchemaCache(object):
         >>> my_schema = SCHEMA_CACHE.get(portal_type)
 
     The cache uses the FTI's modification time as its invariant.
+
+    All information about a type is kept in one immutable ``TypeDescriptor``
+    on the FTI. Reading it is lock free; only building a new descriptor and
+    invalidation are serialized by ``lock``.
     """
 
     lock = RLock()
 
     def __init__(self, cache_enabled=True):
         self.cache_enabled = cache_enabled
+        # BBB: counts all invalidations, use generation(portal_type)
         self.invalidations = 0
+        self.generations = {}
+        # what this process has seen of each persistent SchemaGenerations
+        # registry, see registry_key()
+        self.synced = {}
+        self.synced_counters = {}
+
+    def generation(self, portal_type):
+        """the number of invalidations of the given portal_type
+        """
+        return self.generations.get(portal_type, 0)
+
+    def descriptor(self, portal_type):
+        """the TypeDescriptor of the fti passed in as portal_type string or
+        as FTI, or None if there is no such FTI.
+        """
+        if portal_type is None:
+            return None
+        if IDexterityFTI.providedBy(portal_type):
+            fti = portal_type
+            portal_type = fti.getId()
+        else:
+            fti = self.lookup_fti(portal_type)
+        if fti is None:
+            return None
+        if not self.cache_enabled:
+            return TypeDescriptor(fti)
+
+        # The generation has to be read before the descriptor is built, so
+        # that a concurrent invalidation is never lost.
+        generation = self.generations.get(portal_type, 0)
+        descriptor = getattr(fti, '_v_schema_descriptor', None)
+        if descriptor is not None \
+           and descriptor.mtime == fti._p_mtime \
+           and descriptor.generation == generation:
+            return descriptor
+
+        with self.lock:
+            # another thread may have built it meanwhile
+            descriptor = getattr(fti, '_v_schema_descriptor', None)
+            if descriptor is None \
+               or descriptor.mtime != fti._p_mtime \
+               or descriptor.generation != generation:
+                descriptor = TypeDescriptor(fti, generation)
+                fti._v_schema_descriptor = descriptor
+        return descriptor
+
+    def lookup_fti(self, portal_type):
+        """the FTI of the given portal_type in the current site, or None.
+
+        FTIs found are remembered in a volatile map on the site, so that
+        repeated lookups do not search the component registry. An entry is
+        valid as long as the generation of its type does not change; the
+        generation is incremented when an FTI is added, removed or renamed,
+        and when the type is invalidated.
+
+        The map is read from the instance dict of the site: the site may be
+        Dexterity content, whose ``__getattr__`` would come back here.
+        """
+        site = getSite()
+        if site is not None:
+            site = aq_base(site)
+        generation = self.generations.get(portal_type, 0)
+        ftis = getattr(site, '__dict__', {}).get('_v_dexterity_ftis')
+        if ftis is not None:
+            entry = ftis.get(portal_type)
+            if entry is not None and entry[1] == generation:
+                return entry[0]
+
+        fti = queryUtility(IDexterityFTI, name=portal_type)
+        if fti is not None and site is not None:
+            # known types are bumped by clear()
+            self.generations.setdefault(portal_type, generation)
+            if ftis is None:
+                ftis = site._v_dexterity_ftis = {}
+            ftis[portal_type] = (fti, generation)
+        return fti
 
     @synchronized(lock)
-    @volatile
+    def forget_fti(self, portal_type):
+        """The FTI of the given portal_type was added, removed or renamed:
+        forget the FTIs remembered for it in all sites.
+        """
+        self._bump(portal_type)
+
     def get(self, fti):
         """main schema
 
-        magic! fti is passed in as a string (identifier of fti), then volatile
-        decorator looks it up and passes the FTI instance in.
+        fti is passed in as a string (identifier of fti) or as the FTI itself.
         """
-        if fti is not None:
-            try:
-                return fti.lookupSchema()
-            except (AttributeError, ValueError):
-                pass
+        descriptor = self.descriptor(fti)
+        if descriptor is not None:
+            return descriptor.schema
 
-    @synchronized(lock)
-    @volatile
     def behavior_registrations(self, fti):
         """all behavior behavior registrations of a given fti passed in as
         portal_type string (magic see get)
@@ -123,107 +412,115 @@ class SchemaCache(object):
         ``plone.behavior.registration.BehaviorRegistration`` instances
         for the given fti.
         """
-        if fti is None:
+        descriptor = self.descriptor(fti)
+        if descriptor is None:
             return tuple()
-        registrations = []
-        for behavior_name in fti.behaviors:
-            registration = queryUtility(IBehavior, name=behavior_name)
-            if registration is None:
-                # BBB - this case should be deprecated in v 3.0
-                log.warning(
-                    'No behavior registration found for behavior named: "{0}"'
-                    ' - trying fallback lookup..."'.format(
-                        behavior_name
-                    )
-                )
-                try:
-                    schema_interface = resolve(behavior_name)
-                except (ValueError, ImportError):
-                    log.error(
-                        "Error resolving behavior {0}".format(
-                            behavior_name
-                        )
-                    )
-                    continue
-                registration = BehaviorRegistration(
-                    title=behavior_name,
-                    description="bbb fallback lookup",
-                    interface=schema_interface,
-                    marker=None,
-                    factory=None
-                )
-            registrations.append(registration)
-        return tuple(registrations)
+        return descriptor.behavior_registrations
 
-    @synchronized(lock)
-    @volatile
     def subtypes(self, fti):
         """all registered marker interfaces of ftis behaviors
 
         XXX: this one does not make much sense and should be deprecated
         """
-        if fti is None:
+        descriptor = self.descriptor(fti)
+        if descriptor is None:
             return ()
-        subtypes = []
-        for behavior_registration in self.behavior_registrations(fti):
-            if behavior_registration is not None \
-               and behavior_registration.marker is not None:
-                subtypes.append(behavior_registration.marker)
-        return tuple(subtypes)
+        return descriptor.subtypes
 
-    @synchronized(lock)
-    @volatile
     def behavior_schema_interfaces(self, fti):
         """behavior schema interfaces registered for the fti
 
         all schemas from behaviors
         """
-        if fti is None:
+        descriptor = self.descriptor(fti)
+        if descriptor is None:
             return ()
-        schemas = []
-        for behavior_registration in self.behavior_registrations(fti):
-            if behavior_registration is not None \
-               and behavior_registration.interface:
-                schemas.append(behavior_registration.interface)
-        return tuple(schemas)
+        return descriptor.behavior_schema_interfaces
 
-    @synchronized(lock)
-    @volatile
     def schema_interfaces(self, fti):
         """all schema interfaces registered for the fti
 
         main_schema plus schemas from behaviors
         """
-        if fti is None:
+        descriptor = self.descriptor(fti)
+        if descriptor is None:
             return ()
-        schemas = []
-        try:
-            main_schema = self.get(fti)  # main schema
-            schemas.append(main_schema)
-        except (ValueError, AttributeError):
-            pass
-        for schema in self.behavior_schema_interfaces(fti):
-            schemas.append(schema)
-        return tuple(schemas)
+        return descriptor.schema_interfaces
 
     @synchronized(lock)
     def clear(self):
+        portal_types = set(self.generations)
         for fti in getAllUtilitiesRegisteredFor(IDexterityFTI):
-            self.invalidate(fti)
+            invalidate_cache(fti)
+            portal_types.add(fti.getId())
+        for portal_type in portal_types:
+            self._bump(portal_type)
 
     @synchronized(lock)
     def invalidate(self, fti):
-        if not IDexterityFTI.providedBy(fti):
-            fti = queryUtility(IDexterityFTI, name=fti)
+        if IDexterityFTI.providedBy(fti):
+            portal_type = fti.getId()
+        else:
+            portal_type = fti
+            fti = queryUtility(IDexterityFTI, name=portal_type)
         if fti is not None:
             invalidate_cache(fti)
             self.invalidations += 1
+        self._bump(portal_type)
 
     @synchronized(lock)
-    @volatile
+    def bump(self, portal_types, all=False):
+        """Outdate the descriptors of the given portal_types, and of all
+        types known to the cache if all is true, without touching the FTIs.
+        """
+        portal_types = set(portal_types)
+        if all:
+            portal_types.update(self.generations)
+        for portal_type in sorted(portal_types):
+            self._bump(portal_type)
+        self.invalidations += len(portal_types)
+
+    def sync(self, registry):
+        """Invalidate all types whose generation in the persistent
+        SchemaGenerations registry changed since the last sync, i.e. which
+        were changed by another ZEO client.
+
+        Each site has its own registry, so what was seen is kept per
+        registry. The first time a registry is seen, e.g. after a restart,
+        its generations are only recorded: whatever is cached for its types
+        was built since, from their current state.
+
+        Returns the changed portal_types, sorted.
+        """
+        key = registry_key(registry)
+        counter = registry.counter()
+        if counter == self.synced_counters.get(key):
+            return ()
+        changed = []
+        with self.lock:
+            synced = self.synced.get(key)
+            if synced is None:
+                self.synced[key] = dict(registry.items())
+                self.synced_counters[key] = counter
+                return ()
+            for portal_type, generation in registry.items():
+                if synced.get(portal_type) != generation:
+                    synced[portal_type] = generation
+                    self.invalidate(portal_type)
+                    changed.append(portal_type)
+            self.synced_counters[key] = counter
+        return tuple(changed)
+
+    def _bump(self, portal_type):
+        # descriptors of this type built by other threads, on their copy of
+        # the FTI, are outdated from now on
+        generation = self.generations.get(portal_type, 0)
+        self.generations[portal_type] = generation + 1
+
     def modified(self, fti):
-        if fti:
-            return fti._p_mtime
+        descriptor = self.descriptor(fti)
+        if descriptor is not None:
+            return descriptor.mtime
 
 SCHEMA_CACHE = SchemaCache()
 
@@ -235,12 +532,241 @@ class SchemaInvalidatedEvent(object):
         self.portal_type = portal_type
 
 
+GENERATIONS_KEY = 'plone.dexterity.schema.generations'
+
+
+class SchemaGenerations(Persistent):
+    """The generation of the schema of each portal_type, stored in the ZODB
+    and shared by all ZEO clients.
+
+    Every invalidation of a type increments its generation in the
+    transaction changing the type. The total of all increments is kept in
+    ``counter``, so that clients can cheaply check whether anything changed.
+    Both use ``BTrees.Length.Length`` to resolve concurrent increments.
+    """
+
+    def __init__(self):
+        self.generations = OOBTree()
+        self.counter = Length()
+
+    def get(self, portal_type):
+        length = self.generations.get(portal_type)
+        if length is None:
+            return 0
+        return length()
+
+    def bump(self, portal_type):
+        length = self.generations.get(portal_type)
+        if length is None:
+            length = self.generations[portal_type] = Length()
+        length.change(1)
+        self.counter.change(1)
+        return length()
+
+    def items(self):
+        return [
+            (portal_type, length())
+            for portal_type, length in self.generations.items()
+        ]
+
+
+def registry_key(registry):
+    """A key identifying a SchemaGenerations registry in this process,
+    the same for its copies in all ZODB connections.
+    """
+    oid = getattr(registry, '_p_oid', None)
+    if oid is None:
+        return id(registry)
+    return (registry._p_jar.db().database_name, oid)
+
+
+def schema_generations(site, create=False):
+    """the SchemaGenerations registry of the site, or None
+    """
+    annotations = IAnnotations(site, None)
+    if annotations is None:
+        return None
+    registry = annotations.get(GENERATIONS_KEY)
+    if registry is None and create:
+        registry = annotations[GENERATIONS_KEY] = SchemaGenerations()
+    return registry
+
+
+class InvalidationSavepoint(object):
+
+    def __init__(self, data_manager):
+        self.data_manager = data_manager
+        self.portal_types = set(data_manager.portal_types)
+        self.clear_all = data_manager.clear_all
+        self.generations = dict(data_manager.generations)
+
+    def rollback(self):
+        self.data_manager.portal_types = set(self.portal_types)
+        self.data_manager.clear_all = self.clear_all
+        self.data_manager.generations = dict(self.generations)
+
+
+@implementer(IDataManager)
+class SchemaInvalidations(object):
+    """Transaction data manager collecting the portal_types whose schema was
+    invalidated during a transaction.
+
+    When the transaction commits, the schema cache is invalidated once per
+    collected type. When it aborts, the invalidations are dropped.
+
+    If a SchemaGenerations registry is given, the generation of each type
+    is incremented there once, within the transaction, so that other ZEO
+    clients pick up the change.
+    """
+
+    def __init__(self, cache, transaction_manager, registry=None):
+        self.cache = cache
+        self.transaction_manager = transaction_manager
+        self.registry = registry
+        self._reset()
+
+    def add(self, portal_type):
+        if portal_type:
+            self.portal_types.add(portal_type)
+            portal_types = [portal_type]
+        else:
+            self.clear_all = True
+            portal_types = [
+                fti.getId()
+                for fti in getAllUtilitiesRegisteredFor(IDexterityFTI)
+            ]
+            self.portal_types.update(portal_types)
+        if self.registry is None:
+            return
+        for portal_type in portal_types:
+            if portal_type not in self.generations:
+                self.generations[portal_type] = self.registry.bump(
+                    portal_type
+                )
+
+    def _reset(self):
+        self.portal_types = set()
+        self.clear_all = False
+        self.generations = {}
+
+    def abort(self, transaction):
+        self._reset()
+
+    def tpc_begin(self, transaction):
+        pass
+
+    def commit(self, transaction):
+        pass
+
+    def tpc_vote(self, transaction):
+        pass
+
+    def tpc_finish(self, transaction):
+        portal_types, clear_all = self.portal_types, self.clear_all
+        generations = self.generations
+        self._reset()
+        # No lookups here, they could fail in the last phase of the commit:
+        # the descriptors on the FTIs of this connection were dropped by
+        # invalidate_schema, all others are outdated by their generation.
+        self.cache.bump(portal_types, clear_all)
+        # our own changes need no sync; a registry not seen yet is recorded
+        # completely by its first sync
+        if self.registry is not None:
+            synced = self.cache.synced.get(registry_key(self.registry))
+            if synced is not None:
+                synced.update(generations)
+
+    def tpc_abort(self, transaction):
+        self._reset()
+
+    def savepoint(self):
+        return InvalidationSavepoint(self)
+
+    def sortKey(self):
+        return 'plone.dexterity.schema.SchemaInvalidations:%d' % id(self)
+
+
+_pending_invalidations = WeakKeyDictionary()
+
+
+def pending_invalidations(cache=None):
+    """the SchemaInvalidations data manager joined to the current
+    transaction, joining a new one if necessary
+    """
+    if cache is None:
+        cache = SCHEMA_CACHE
+    txn = transaction.get()
+    data_manager = _pending_invalidations.get(txn)
+    if data_manager is None or data_manager.cache is not cache:
+        site = queryUtility(ISiteRoot)
+        registry = None
+        if site is not None:
+            registry = schema_generations(site, create=True)
+        data_manager = SchemaInvalidations(
+            cache,
+            transaction.manager,
+            registry
+        )
+        txn.join(data_manager)
+        _pending_invalidations[txn] = data_manager
+    return data_manager
+
+
 @adapter(ISchemaInvalidatedEvent)
 def invalidate_schema(event):
+    # The current transaction sees the change at once. Invalidating the
+    # cache for everybody else waits for the commit, so that changing many
+    # properties of many FTIs in one transaction costs one invalidation per
+    # type.
     if event.portal_type:
-        SCHEMA_CACHE.invalidate(event.portal_type)
+        fti = queryUtility(IDexterityFTI, name=event.portal_type)
+        if fti is not None:
+            invalidate_cache(fti)
     else:
-        SCHEMA_CACHE.clear()
+        for fti in getAllUtilitiesRegisteredFor(IDexterityFTI):
+            invalidate_cache(fti)
+    pending_invalidations().add(event.portal_type)
+
+
+def sync_generated_schemata(fti, prefix=None):
+    """Update the generated interfaces of a type with a model from its
+    current model, in a stable order.
+    """
+    if not (fti.model_source or fti.model_file):
+        return
+    model = fti.lookupModel()
+    for schemaName in sorted(model.schemata):
+        name = portalTypeToSchemaName(fti.getId(), schemaName, prefix)
+        schema = generated.__dict__.get(name)
+        if schema is not None:
+            syncSchema(
+                model.schemata[schemaName],
+                schema,
+                overwrite=True,
+                sync_bases=True
+            )
+
+
+def sync_schema_generations(site, event):
+    """Pick up schema changes committed by other ZEO clients.
+
+    Called when the site is traversed. This is cheap unless the persistent
+    SchemaGenerations registry of the site changed since the last request.
+    """
+    registry = schema_generations(site)
+    if registry is None:
+        return
+    changed = SCHEMA_CACHE.sync(registry)
+    if not changed:
+        return
+    # the local site may not be set yet
+    site_manager = site.getSiteManager()
+    prefix = '/'.join(site.getPhysicalPath())[1:]
+    for portal_type in changed:
+        fti = site_manager.queryUtility(IDexterityFTI, name=portal_type)
+        if fti is not None:
+            invalidate_cache(fti)
+            sync_generated_schemata(fti, prefix)
 
 
 # here starts the code dealing wih dynamic schemas.
@@ -255,15 +781,17 @@ class SchemaNameEncoder(object):
         ('/', '_4_'),
     )
 
+    # encoding and decoding replace all keys in one pass over the string
+    _encodings = dict(key)
+    _decodings = dict((v, k) for k, v in key)
+    _encode = re.compile('[ ./-]').sub
+    _decode = re.compile('_[1-4]_').sub
+
     def encode(self, s):
-        for k, v in self.key:
-            s = s.replace(k, v)
-        return s
+        return self._encode(lambda m: self._encodings[m.group()], s)
 
     def decode(self, s):
-        for k, v in self.key:
-            s = s.replace(v, k)
-        return s
+        return self._decode(lambda m: self._decodings[m.group()], s)
 
     def join(self, *args):
         return '_0_'.join([self.encode(a) for a in args if a])
@@ -271,35 +799,145 @@ class SchemaNameEncoder(object):
     def split(self, s):
         return [self.decode(a) for a in s.split('_0_')]
 
+_encoder = SchemaNameEncoder()
+
+# memos of portalTypeToSchemaName and splitSchemaName; cleared when they
+# grow too large, e.g. because of crawlers probing random names
+MEMO_SIZE = 10000
+_schema_names = {}
+_split_names = {}
+
+
+def _site_prefix():
+    site = getSite()
+    if site is None or not ISiteRoot.providedBy(site):
+        site = getUtility(ISiteRoot)
+    # Not remembered on the site: moving a parent of the site does not
+    # change the site object, so other ZODB connections and ZEO clients
+    # would never notice.
+    return '/'.join(site.getPhysicalPath())[1:]
+
 
 def portalTypeToSchemaName(portal_type, schema=u"", prefix=None):
     """Return a canonical interface name for a generated schema interface.
     """
     if prefix is None:
-        prefix = '/'.join(getUtility(ISiteRoot).getPhysicalPath())[1:]
+        prefix = _site_prefix()
 
-    encoder = SchemaNameEncoder()
-    return encoder.join(prefix, portal_type, schema)
+    key = (prefix, portal_type, schema)
+    name = _schema_names.get(key)
+    if name is None:
+        if len(_schema_names) >= MEMO_SIZE:
+            _schema_names.clear()
+        name = _encoder.join(prefix, portal_type, schema)
+        _schema_names[key] = name
+    return name
 
 
 def schemaNameToPortalType(schemaName):
     """Return a the portal_type part of a schema name
     """
-    encoder = SchemaNameEncoder()
-    return encoder.split(schemaName)[1]
+    return _encoder.split(schemaName)[1]
 
 
 def splitSchemaName(schemaName):
     """Return a tuple prefix, portal_type, schemaName
     """
-    encoder = SchemaNameEncoder()
-    items = encoder.split(schemaName)
+    items = _split_names.get(schemaName)
+    if items is not None:
+        return items
+    items = _encoder.split(schemaName)
     if len(items) == 2:
-        return items[0], items[1], u""
+        items = items[0], items[1], u""
     elif len(items) == 3:
-        return items[0], items[1], items[2]
+        items = items[0], items[1], items[2]
     else:
         raise ValueError("Schema name %s is invalid" % schemaName)
+    if len(_split_names) >= MEMO_SIZE:
+        _split_names.clear()
+    _split_names[schemaName] = items
+    return items
+
+
+def clear_schema_names(site, event=None):
+    """Forget the schema names computed for the old path of the site, after
+    it was renamed or moved.
+    """
+    _schema_names.clear()
+
+
+class TransientSchemaCache(object):
+    """Bounded table of the interfaces created by SchemaModuleFactory for
+    names without an FTI.
+
+    Such names come from unpickling objects of removed types or from
+    probing random names. Adding an entry retires the oldest one once the
+    table is full, and the entries of a portal_type in a site are retired
+    when its FTI is removed. Retired interfaces are only weakly referenced:
+    as long as objects still use one, looking up its name returns it again,
+    so that there is never more than one interface for a name.
+
+    ``hits``, ``created`` and ``evicted`` are approximate counters for
+    monitoring; ``len()`` is the number of entries which are not retired.
+
+    Reads are lock free; changes are made while holding
+    ``SchemaModuleFactory.lock``.
+    """
+
+    def __init__(self, size=1000):
+        self.size = size
+        self.clear()
+
+    def get(self, name):
+        schema = self.lookup(name)
+        if schema is not None:
+            self.hits += 1
+        return schema
+
+    def lookup(self, name):
+        schema = self.schemata.get(name)
+        if schema is None:
+            schema = self.retired.get(name)
+        return schema
+
+    def add(self, name, schema):
+        while len(self.schemata) >= self.size:
+            self._retire(*self.schemata.popitem(last=False))
+        self.schemata[name] = schema
+        self.created += 1
+
+    def remove(self, name):
+        self.schemata.pop(name, None)
+        self.retired.pop(name, None)
+
+    def evict(self, portal_type, prefix):
+        """Retire the entries of the given portal_type in the site with the
+        given schema name prefix.
+        """
+        with SchemaModuleFactory.lock:
+            for name in list(self.schemata):
+                if splitSchemaName(name)[:2] == (prefix, portal_type):
+                    self._retire(name, self.schemata.pop(name))
+
+    def _retire(self, name, schema):
+        self.retired[name] = schema
+        self.evicted += 1
+        log.info('Retired placeholder schema %s', name)
+
+    def clear(self):
+        self.schemata = OrderedDict()
+        self.retired = WeakValueDictionary()
+        self.hits = 0
+        self.created = 0
+        self.evicted = 0
+
+    def __contains__(self, name):
+        return self.lookup(name) is not None
+
+    def __len__(self):
+        return len(self.schemata)
+
+TRANSIENT_SCHEMA_CACHE = TransientSchemaCache()
 
 
 # Dynamic module factory
@@ -309,9 +947,8 @@ class SchemaModuleFactory(object):
     """
 
     lock = RLock()
-    _transient_SCHEMA_CACHE = {}
+    _transient_SCHEMA_CACHE = TRANSIENT_SCHEMA_CACHE
 
-    @synchronized(lock)
     def __call__(self, name, module):
         """Someone tried to load a dynamic interface that has not yet been
         created yet. We will attempt to load it from the FTI if we can. If
@@ -321,8 +958,8 @@ class SchemaModuleFactory(object):
         The goal here is to ensure that we create exactly one interface
         instance for each name. If we can't find an FTI, we'll cache the
         interface so that we don't get a new one with a different id later.
-        This cache is global, so we synchronise the method with a thread
-        lock.
+        This cache is global, so changes to it are synchronised with a
+        thread lock.
 
         Once we have a properly populated interface, we set it onto the
         module using setattr(). This means that the factory will not be
@@ -334,9 +971,19 @@ class SchemaModuleFactory(object):
         except ValueError:
             return None
 
-        if name in self._transient_SCHEMA_CACHE:
-            schema = self._transient_SCHEMA_CACHE[name]
-        else:
+        # Names which are still without an FTI do not need the lock
+        schema = self._transient_SCHEMA_CACHE.get(name)
+        fti = queryUtility(IDexterityFTI, name=portal_type)
+        if schema is not None and fti is None:
+            return schema
+
+        return self._create(name, module, schemaName, fti)
+
+    @synchronized(lock)
+    def _create(self, name, module, schemaName, fti):
+        schema = self._transient_SCHEMA_CACHE.lookup(name)
+        transient = schema is not None
+        if not transient:
             bases = ()
 
             is_default_schema = not schemaName
@@ -348,9 +995,8 @@ class SchemaModuleFactory(object):
             if is_default_schema:
                 alsoProvides(schema, IContentType)
 
-        fti = queryUtility(IDexterityFTI, name=portal_type)
-        if fti is None and name not in self._transient_SCHEMA_CACHE:
-            self._transient_SCHEMA_CACHE[name] = schema
+        if fti is None and not transient:
+            self._transient_SCHEMA_CACHE.add(name, schema)
         elif fti is not None:
             model = fti.lookupModel()
             syncSchema(model.schemata[schemaName], schema, sync_bases=True)
@@ -358,8 +1004,7 @@ class SchemaModuleFactory(object):
             # Save this schema in the module - this factory will not be
             # called again for this name
 
-            if name in self._transient_SCHEMA_CACHE:
-                del self._transient_SCHEMA_CACHE[name]
+            self._transient_SCHEMA_CACHE.remove(name)
 
             setattr(module, name, schema)
 
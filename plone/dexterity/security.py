@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+from AccessControl import getSecurityManager
+from plone.dexterity.interfaces import IMemoizePermissionChecks
+from zope.annotation.interfaces import IAnnotations
+
+MEMO_KEY = 'plone.dexterity.permission_memo'
+
+
+class PermissionMemo(object):
+    """The results of the permission checks done in one request.
+
+    ``saved`` counts the checks which were answered from the memo.
+    """
+
+    def __init__(self):
+        self.results = {}
+        self.saved = 0
+
+    def clear(self):
+        self.results.clear()
+
+
+def getPermissionMemo(request, create=False):
+    """Return the permission memo of the request.
+
+    Returns None if the request does not provide IMemoizePermissionChecks,
+    or if it has no memo yet and create is False.
+    """
+    if request is None or not IMemoizePermissionChecks.providedBy(request):
+        return None
+    annotations = IAnnotations(request, None)
+    if annotations is None:
+        return None
+    memo = annotations.get(MEMO_KEY)
+    if memo is None and create:
+        memo = annotations[MEMO_KEY] = PermissionMemo()
+    return memo
+
+
+def _executable(security_manager):
+    # The owner and the proxy roles of the executable on top of the security
+    # stack, e.g. a Python script, take part in the check.
+    context = getattr(security_manager, '_context', None)
+    stack = getattr(context, 'stack', None)
+    if stack:
+        return stack[-1]
+    return None
+
+
+def checkPermission(permission, obj):
+    """Check whether the current user has the permission on obj.
+
+    The same as getSecurityManager().checkPermission(permission, obj), but
+    if the request provides IMemoizePermissionChecks, the result is memoized
+    for the rest of the request, keyed by user, executable, permission and
+    physical path of obj.
+    """
+    security_manager = getSecurityManager()
+    memo = getPermissionMemo(getattr(obj, 'REQUEST', None), create=True)
+    if memo is None:
+        return security_manager.checkPermission(permission, obj)
+
+    path = obj.getPhysicalPath()
+    if not path or path[0] != '':
+        # obj is not acquisition wrapped, its path does not identify it
+        return security_manager.checkPermission(permission, obj)
+
+    key = (
+        security_manager.getUser().getId(),
+        _executable(security_manager),
+        permission,
+        path,
+    )
+    try:
+        result = memo.results[key]
+    except KeyError:
+        result = memo.results[key] = security_manager.checkPermission(
+            permission,
+            obj
+        )
+    else:
+        memo.saved += 1
+    return result
+
+
+def clearPermissionMemo(obj, event=None):
+    """Forget the memoized permission checks of the current request.
+
+    Registered for workflow transitions, local role changes and moves. Call
+    it after changing roles or permissions in other ways during a request.
+    """
+    memo = getPermissionMemo(getattr(obj, 'REQUEST', None))
+    if memo is not None:
+        memo.clear()
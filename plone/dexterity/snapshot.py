@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""On-disk snapshot of the models of TTW types, to avoid parsing their XML
+after a restart.
+
+The snapshot maps a digest of the model source, schema policy and behaviors
+of each FTI to the fields, bases and tagged values of the schemata of its
+model. Loading it preloads ``MODEL_CACHE`` with the models of all FTIs
+whose digest matches, where they stay until they are first looked up; all
+other types are parsed as usual.
+
+The header of the snapshot holds a digest of the versions of all installed
+distributions. The models were built by plone.supermodel, plone.autoform
+and the field handlers of add-ons, so a snapshot written before any of them
+was upgraded is ignored.
+"""
+from App.config import getConfiguration
+from copy import copy
+from plone.dexterity.fti import MODEL_CACHE
+from plone.supermodel.model import Model
+from zope.dottedname.resolve import resolve
+from zope.interface.interface import InterfaceClass
+
+import cPickle
+import hashlib
+import logging
+import os
+import pkg_resources
+
+log = logging.getLogger(__name__)
+
+MAGIC = 'plone.dexterity.schema-snapshot'
+VERSION = 1
+
+
+def snapshot_path():
+    """The path of the snapshot file, as configured in zope.conf::
+
+        <product-config plone.dexterity>
+            schema-snapshot ${buildout:directory}/var/schemata.snapshot
+        </product-config>
+
+    or None.
+    """
+    product_config = getattr(getConfiguration(), 'product_config', None)
+    config = (product_config or {}).get('plone.dexterity') or {}
+    return config.get('schema-snapshot')
+
+
+def environment_digest():
+    """A digest of the names and versions of all installed distributions.
+    """
+    versions = sorted(
+        '%s==%s' % (dist.project_name, dist.version)
+        for dist in pkg_resources.working_set
+    )
+    return hashlib.sha1('\n'.join(versions)).hexdigest()
+
+
+def snapshot_header():
+    return '%s %d %s\n' % (MAGIC, VERSION, environment_digest())
+
+
+def model_digest(fti):
+    data = repr((
+        fti.model_source,
+        fti.schema_policy,
+        tuple(fti.behaviors),
+    ))
+    return hashlib.sha1(data).hexdigest()
+
+
+def dump_model(model):
+    """The picklable content of the schemata of a model.
+    """
+    schemata = {}
+    for schemaName, schema in model.schemata.items():
+        fields = []
+        for name in schema.names():
+            field = copy(schema[name])
+            field.interface = None
+            fields.append((name, field))
+        tagged_values = dict(
+            (key, schema.queryTaggedValue(key))
+            for key in schema.getTaggedValueTags()
+        )
+        bases = [base.__identifier__ for base in schema.__bases__]
+        schemata[schemaName] = (
+            schema.__name__,
+            schema.__module__,
+            bases,
+            fields,
+            tagged_values,
+        )
+    return schemata
+
+
+def load_model(schemata):
+    """A model from the result of dump_model.
+    """
+    model = Model()
+    for schemaName, data in schemata.items():
+        name, module, bases, fields, tagged_values = data
+        schema = InterfaceClass(
+            name,
+            tuple(resolve(base) for base in bases),
+            dict(fields),
+            __module__=module
+        )
+        for key, value in tagged_values.items():
+            schema.setTaggedValue(key, value)
+        model.schemata[schemaName] = schema
+    return model
+
+
+def write_snapshot(path, ftis):
+    """Write the models of all FTIs with a model source to the snapshot.
+
+    Types whose model cannot be pickled are left out. The entries already in
+    the snapshot are kept, so that several sites can share one file; remove
+    the file to drop the entries of old models.
+    """
+    entries = read_snapshot(path) or {}
+    for fti in ftis:
+        if not fti.model_source:
+            continue
+        try:
+            data = dump_model(fti.lookupModel())
+            cPickle.dumps(data, 2)
+        except Exception:
+            log.warning(
+                'Cannot store the model of %s in the snapshot',
+                fti.getId(),
+                exc_info=True
+            )
+            continue
+        entries[model_digest(fti)] = data
+
+    payload = cPickle.dumps(entries, 2)
+    checksum = hashlib.sha256(payload).hexdigest()
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(snapshot_header())
+        f.write(checksum + '\n')
+        f.write(payload)
+    os.rename(temp_path, path)
+    return len(entries)
+
+
+def read_snapshot(path):
+    """The entries of the snapshot, or None if it is missing, of another
+    version, written with other versions of the installed distributions or
+    damaged.
+    """
+    try:
+        with open(path, 'rb') as f:
+            header = f.readline()
+            checksum = f.readline().strip()
+            payload = f.read()
+    except IOError:
+        return None
+    if header != snapshot_header():
+        log.info(
+            'Ignoring schema snapshot %s of another version or written with '
+            'other versions of the installed distributions',
+            path
+        )
+        return None
+    if hashlib.sha256(payload).hexdigest() != checksum:
+        log.warning('Ignoring damaged schema snapshot %s', path)
+        return None
+    return cPickle.loads(payload)
+
+
+def load_snapshot(path, ftis):
+    """Preload MODEL_CACHE with the models of all FTIs whose digest matches
+    an entry of the snapshot. Returns the number of models loaded.
+    """
+    entries = read_snapshot(path)
+    if not entries:
+        return 0
+    loaded = 0
+    for fti in ftis:
+        if not fti.model_source:
+            continue
+        data = entries.get(model_digest(fti))
+        if data is None:
+            continue
+        try:
+            model = load_model(data)
+        except Exception:
+            log.warning(
+                'Cannot load the model of %s from the snapshot',
+                fti.getId(),
+                exc_info=True
+            )
+            continue
+        MODEL_CACHE.preload((fti.model_source, fti.schema_policy), model)
+        loaded += 1
+    return loaded
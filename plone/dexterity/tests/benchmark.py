@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""Small helpers for the benchmark tests.
+
+The benchmarks run as part of the normal test suite with modest iteration
+counts. They assert on things that can be counted (lock acquisitions, lookups,
+rebuilds) and only log the timings, so that they stay stable on slow or busy
+test machines. Set the ``plone.dexterity.benchmark`` logger to INFO to see the
+numbers, and the ``PLONE_DEXTERITY_BENCHMARK_FULL`` environment variable to
+run the benchmarks which support it at full size.
+"""
+from threading import Thread
+
+import logging
+import os
+import time
+
+log = logging.getLogger('plone.dexterity.benchmark')
+
+
+def scale(modest, full):
+    """The modest size of a benchmark, or the full one if the
+    ``PLONE_DEXTERITY_BENCHMARK_FULL`` environment variable is set.
+    """
+    if os.environ.get('PLONE_DEXTERITY_BENCHMARK_FULL'):
+        return full
+    return modest
+
+
+def measure(func, iterations):
+    """Call ``func`` ``iterations`` times and return calls per second.
+    """
+    start = time.time()
+    for i in xrange(iterations):
+        func()
+    elapsed = time.time() - start
+    return iterations / max(elapsed, 1e-9)
+
+
+def measure_threaded(func, threads, iterations):
+    """Call ``func`` ``iterations`` times in each of ``threads`` threads
+    and return the total number of calls per second.
+    """
+    def worker():
+        for i in xrange(iterations):
+            func()
+
+    workers = [Thread(target=worker) for i in range(threads)]
+    start = time.time()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.time() - start
+    return threads * iterations / max(elapsed, 1e-9)
+
+
+def report(name, **results):
+    log.info(
+        '%s: %s',
+        name,
+        ', '.join(
+            '%s=%s' % (key, value) for key, value in sorted(results.items())
+        )
+    )
+
+
+class CountingLock(object):
+    """Wraps a lock and counts how often it was acquired.
+    """
+
+    def __init__(self, lock):
+        self.lock = lock
+        self.acquired = 0
+
+    def acquire(self, *args, **kwargs):
+        self.acquired += 1
+        return self.lock.acquire(*args, **kwargs)
+
+    def release(self):
+        return self.lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class CountingSiteManager(object):
+    """Counts the utility lookups of the wrapped site manager.
+    """
+
+    def __init__(self, site_manager):
+        self.site_manager = site_manager
+        self.lookups = 0
+
+    def queryUtility(self, *args, **kwargs):
+        self.lookups += 1
+        return self.site_manager.queryUtility(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.site_manager, name)
+
+
+class DummySite(object):
+
+    def __init__(self, site_manager):
+        self.site_manager = site_manager
+
+    def getSiteManager(self):
+        return self.site_manager
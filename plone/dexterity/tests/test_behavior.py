@@ -1,10 +1,15 @@
 # -*- coding: utf-8 -*-
 from plone.behavior.interfaces import IBehavior
 from plone.dexterity.behavior import DexterityBehaviorAssignable
+from plone.dexterity.behavior import behaviorAssignable
 from plone.dexterity.fti import DexterityFTI
 from plone.dexterity.interfaces import IDexterityFTI
+from plone.dexterity.schema import SCHEMA_CACHE
+from plone.dexterity.tests.benchmark import measure
+from plone.dexterity.tests.benchmark import report
 from plone.mocktestcase import MockTestCase
 from zope.interface import Interface
+from zope.interface.interface import InterfaceClass
 import unittest
 
 
@@ -82,6 +87,105 @@ class TestBehavior(MockTestCase):
             list(assignable.enumerateBehaviors())
         )
 
+    def test_assignable_shared_per_type(self):
+        SCHEMA_CACHE.clear()
+
+        context_dummy1 = self.create_dummy(portal_type=u"testtype")
+        context_dummy2 = self.create_dummy(portal_type=u"testtype")
+        context_dummy3 = self.create_dummy(portal_type=u"othertype")
+
+        behavior_dummy = self.create_dummy(interface=IFour)
+        self.mock_utility(behavior_dummy, IBehavior, name=IFour.__identifier__)
+
+        fti = DexterityFTI(u"testtype")
+        fti.behaviors = [IFour.__identifier__]
+        self.mock_utility(fti, IDexterityFTI, name=u"testtype")
+
+        self.replay()
+
+        assignable = behaviorAssignable(context_dummy1)
+        self.assertTrue(assignable is behaviorAssignable(context_dummy2))
+        self.assertFalse(assignable is behaviorAssignable(context_dummy3))
+        self.assertEqual(None, assignable.context)
+
+        self.assertEqual(True, assignable.supports(IThree))
+        self.assertEqual(False, assignable.supports(ITwo))
+        self.assertEqual(False, behaviorAssignable(context_dummy3).supports(
+            IThree
+        ))
+
+    def test_assignable_without_portal_type(self):
+        # e.g. content before the factory set its portal_type
+        context_dummy = self.create_dummy(portal_type=None)
+
+        self.replay()
+
+        assignable = behaviorAssignable(context_dummy)
+        self.assertEqual([], list(assignable.enumerateBehaviors()))
+        self.assertEqual(False, assignable.supports(IOne))
+
+    def test_supports_of_subclass(self):
+        # e.g. collective.instancebehavior adds behaviors of the instance
+
+        context_dummy = self.create_dummy(portal_type=u"testtype")
+        instance_behavior = self.create_dummy(interface=IFour)
+
+        fti = DexterityFTI(u"testtype")
+        fti.behaviors = []
+        self.mock_utility(fti, IDexterityFTI, name=u"testtype")
+
+        class InstanceBehaviorAssignable(DexterityBehaviorAssignable):
+
+            def enumerateBehaviors(self):
+                for behavior in super(
+                    InstanceBehaviorAssignable,
+                    self
+                ).enumerateBehaviors():
+                    yield behavior
+                yield instance_behavior
+
+        self.replay()
+
+        assignable = InstanceBehaviorAssignable(context_dummy)
+        self.assertEqual(True, assignable.supports(IThree))
+        self.assertEqual(False, assignable.supports(ITwo))
+        self.assertEqual(
+            False,
+            DexterityBehaviorAssignable(context_dummy).supports(IThree)
+        )
+
+    def test_benchmark_supports(self):
+        SCHEMA_CACHE.clear()
+
+        context_dummy = self.create_dummy(portal_type=u"testtype")
+
+        behaviors = []
+        for i in range(50):
+            interface = InterfaceClass('IBehavior%d' % i, (Interface, ))
+            name = 'plone.dexterity.tests.IBehavior%d' % i
+            behavior_dummy = self.create_dummy(interface=interface)
+            self.mock_utility(behavior_dummy, IBehavior, name=name)
+            behaviors.append((name, interface))
+
+        fti = DexterityFTI(u"testtype")
+        fti.behaviors = [name for name, interface in behaviors]
+        self.mock_utility(fti, IDexterityFTI, name=u"testtype")
+
+        self.replay()
+
+        last = behaviors[-1][1]
+        assignable = behaviorAssignable(context_dummy)
+        self.assertTrue(assignable.supports(last))
+
+        rate = measure(
+            lambda: behaviorAssignable(context_dummy).supports(last),
+            10000
+        )
+        report(
+            'IBehaviorAssignable.supports with %d behaviors' % len(behaviors),
+            lookups_per_second=int(rate)
+        )
+
 
 def test_suite():
     return unittest.defaultTestLoader.loadTestsFromName(__name__)
@@ -2,7 +2,15 @@
 from plone.dexterity.factory import DexterityFactory
 from plone.dexterity.fti import DexterityFTI
 from plone.dexterity.interfaces import IDexterityFTI
+from plone.dexterity.schema import SCHEMA_CACHE
+from plone.dexterity.tests.benchmark import CountingSiteManager
+from plone.dexterity.tests.benchmark import DummySite
+from plone.dexterity.tests.benchmark import measure
+from plone.dexterity.tests.benchmark import report
 from plone.mocktestcase import MockTestCase
+from zope.component import getGlobalSiteManager
+from zope.component.hooks import setHooks
+from zope.component.hooks import setSite
 from zope.interface import Interface
 import unittest
 
@@ -34,7 +42,7 @@ class TestFactory(MockTestCase):
         self.assertEqual("Mock type description", factory.description)
 
     def test_get_interfaces(self):
-        fti_mock = self.mocker.mock(DexterityFTI)
+        fti_mock = self.mocker.proxy(DexterityFTI(u"testtype"))
         self.expect(fti_mock.lookupSchema()).result(IDummy)
         self.mock_utility(fti_mock, IDexterityFTI, name=u"testtype")
 
@@ -200,6 +208,75 @@ class TestFactory(MockTestCase):
         factory = DexterityFactory(portal_type=u"testtype")
         self.assertEqual(obj_mock, factory(u"id", title=u"title"))
 
+    def test_create_resolves_class_once(self):
+
+        class Content(object):
+            portal_type = u"testtype"
+
+        # Resolver: only asked again when the klass changes
+        resolver_mock = self.mocker.replace(
+            "plone.dexterity.utils.resolveDottedName"
+        )
+        self.expect(
+            resolver_mock("my.mocked.ContentTypeClass")
+        ).result(Content)
+        self.expect(
+            resolver_mock("my.mocked.OtherContentTypeClass")
+        ).result(Content)
+
+        # FTI
+        fti_mock = self.mocker.mock(DexterityFTI)
+        self.expect(fti_mock.klass).result(
+            "my.mocked.ContentTypeClass"
+        ).count(3)
+        self.expect(fti_mock.klass).result("my.mocked.OtherContentTypeClass")
+        self.mock_utility(fti_mock, IDexterityFTI, name=u"testtype")
+
+        self.replay()
+
+        factory = DexterityFactory(portal_type=u"testtype")
+        for i in range(4):
+            self.assertTrue(isinstance(factory(), Content))
+
+    def test_get_interfaces_cached(self):
+        fti_mock = self.mocker.proxy(DexterityFTI(u"testtype"))
+        self.expect(fti_mock.lookupSchema()).result(IDummy).count(2)
+        self.mock_utility(fti_mock, IDexterityFTI, name=u"testtype")
+
+        self.replay()
+
+        # the schema is looked up once per descriptor of the type
+        factory = DexterityFactory(portal_type=u"testtype")
+        spec = factory.getInterfaces()
+        self.assertTrue(factory.getInterfaces() is spec)
+
+        SCHEMA_CACHE.invalidate(u"testtype")
+        self.assertFalse(factory.getInterfaces() is spec)
+        self.assertEqual([IDummy, Interface], list(spec.flattened()))
+
+    def test_benchmark_creation(self):
+        fti = DexterityFTI(u"testtype")
+        fti.klass = 'plone.dexterity.content.Item'
+        self.mock_utility(fti, IDexterityFTI, name=u"testtype")
+
+        self.replay()
+
+        factory = DexterityFactory(portal_type=u"testtype")
+        site_manager = CountingSiteManager(getGlobalSiteManager())
+        setSite(DummySite(site_manager))
+        setHooks()
+        try:
+            self.assertEqual(u"testtype", factory().portal_type)
+
+            # mass creation does not search the component registry
+            site_manager.lookups = 0
+            rate = measure(factory, 2000)
+            self.assertEqual(0, site_manager.lookups)
+        finally:
+            setSite(None)
+
+        report('DexterityFactory objects per second', created=int(rate))
+
 
 def test_suite():
     return unittest.defaultTestLoader.loadTestsFromName(__name__)
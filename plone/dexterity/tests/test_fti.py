@@ -4,6 +4,7 @@ from plone.dexterity import utils
 from plone.dexterity.factory import DexterityFactory
 from plone.dexterity.fti import DexterityFTI
 from plone.dexterity.fti import DexterityFTIModificationDescription
+from plone.dexterity.fti import MODEL_CACHE
 from plone.dexterity.fti import ftiAdded
 from plone.dexterity.fti import ftiModified
 from plone.dexterity.fti import ftiRemoved
@@ -28,6 +29,8 @@ from zope.security.interfaces import IPermission
 
 import mocker
 import os.path
+import shutil
+import tempfile
 import plone.dexterity.schema.generated
 import unittest
 import zope.schema
@@ -47,6 +50,9 @@ class ITestInterface(Interface):
 
 class TestFTI(MockTestCase):
 
+    def setUp(self):
+        MODEL_CACHE.clear()
+
     def test_factory_name_is_fti_id(self):
         fti = DexterityFTI(u"testtype")
         self.assertEqual(u"testtype", fti.getId())
@@ -217,6 +223,174 @@ class TestFTI(MockTestCase):
         self.assertIs(model_dummy, model)
         self.assertIs(ITestSchema, fti.lookupSchema())
 
+    def test_lookupModel_from_string_cached(self):
+        fti = DexterityFTI(u"testtype")
+        fti.schema = None
+        fti.model_source = "<model />"
+        fti.model_file = None
+
+        other_fti = DexterityFTI(u"othertype")
+        other_fti.schema = None
+        other_fti.model_source = "<model />"
+        other_fti.model_file = None
+
+        class IModelSchema(Interface):
+            title = zope.schema.TextLine(title=u"Title")
+
+        model_dummy = Model({u"": IModelSchema})
+        changed_dummy = Model()
+
+        loadString_mock = self.mocker.replace("plone.supermodel.loadString")
+        self.expect(
+            loadString_mock("<model />", policy=u"dexterity")
+        ).result(model_dummy)
+        self.expect(
+            loadString_mock("<model>  </model>", policy=u"dexterity")
+        ).result(changed_dummy)
+
+        self.replay()
+
+        # parsed once for every FTI with the same source and policy
+        self.assertIs(model_dummy, fti.lookupModel())
+        model = fti.lookupModel()
+        other_model = other_fti.lookupModel()
+        self.assertEqual(1, MODEL_CACHE.misses)
+        self.assertEqual(2, MODEL_CACHE.hits)
+
+        # every caller gets its own copy, which it may change
+        self.assertIsNot(model_dummy, model)
+        self.assertIsNot(model.schema, other_model.schema)
+        self.assertEqual(['title'], model.schema.names())
+        self.assertIs(model.schema, model.schema['title'].interface)
+        model.schema['title'].title = u"Changed"
+        model_dummy.schema['title'].title = u"Changed"
+        self.assertEqual(
+            u"Title",
+            other_fti.lookupModel().schema['title'].title
+        )
+
+        # a changed source is parsed again
+        fti.model_source = "<model>  </model>"
+        self.assertIs(changed_dummy, fti.lookupModel())
+        self.assertEqual(
+            ['title'],
+            other_fti.lookupModel().schema.names()
+        )
+
+    def test_model_cache_is_bounded(self):
+        from plone.dexterity.fti import ModelCache
+        cache = ModelCache(size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.set('c', 3)
+        self.assertEqual(len(cache.models), 2)
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(cache.misses, 1)
+
+    def test_model_cache_evicts_least_recently_used(self):
+        from plone.dexterity.fti import ModelCache
+        cache = ModelCache(size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+
+        # room for the models of all types of a site
+        cache.reserve(3)
+        for key in 'def':
+            cache.set(key, key)
+        self.assertEqual(['a', 'c', 'd', 'e', 'f'], sorted(cache.models))
+
+    def test_lookupModel_from_file_cached(self):
+        tempdir = tempfile.mkdtemp()
+        model_file = os.path.join(tempdir, 'model.xml')
+
+        def write(content):
+            with open(model_file, 'w') as f:
+                f.write(content)
+
+        write('<model />')
+
+        fti = DexterityFTI(u"testtype")
+        fti.schema = None
+        fti.model_source = None
+        fti.model_file = model_file
+
+        model_dummy = Model()
+        changed_dummy = Model()
+
+        loadFile_mock = self.mocker.replace("plone.supermodel.loadFile")
+        self.expect(
+            loadFile_mock(model_file, reload=True, policy=u"dexterity")
+        ).result(model_dummy)
+        self.expect(
+            loadFile_mock(model_file, reload=True, policy=u"dexterity")
+        ).result(changed_dummy).count(3)
+
+        self.replay()
+
+        MODEL_CACHE.file_mode = 'stat'
+        try:
+            # read once as long as the file does not change; hits return
+            # a copy
+            self.assertIs(model_dummy, fti.lookupModel())
+            self.assertIsNot(model_dummy, fti.lookupModel())
+            self.assertEqual(1, MODEL_CACHE.misses)
+            self.assertEqual(1, MODEL_CACHE.hits)
+
+            # a changed file is read again
+            write('<model></model>')
+            self.assertIs(changed_dummy, fti.lookupModel())
+            self.assertIsNot(changed_dummy, fti.lookupModel())
+            self.assertEqual(2, MODEL_CACHE.misses)
+
+            # in production mode, the file is not looked at anymore
+            MODEL_CACHE.file_mode = 'production'
+            write('<model>  </model>')
+            fti.lookupModel()
+            self.assertEqual(2, MODEL_CACHE.misses)
+
+            # in development mode, it is read on every lookup
+            MODEL_CACHE.file_mode = 'dev'
+            self.assertIs(changed_dummy, fti.lookupModel())
+            self.assertIs(changed_dummy, fti.lookupModel())
+        finally:
+            MODEL_CACHE.file_mode = 'stat'
+            shutil.rmtree(tempdir)
+
+    def test_model_file_mode_configuration(self):
+        from App.config import getConfiguration
+        from plone.dexterity.fti import configured_file_mode
+        configuration = getConfiguration()
+        product_config = getattr(configuration, 'product_config', None)
+        debug_mode = getattr(configuration, 'debug_mode', False)
+        try:
+            configuration.product_config = {}
+            configuration.debug_mode = False
+            self.assertEqual('stat', configured_file_mode())
+
+            # development mode reads model files on every lookup
+            configuration.debug_mode = True
+            self.assertEqual('dev', configured_file_mode())
+
+            configuration.product_config = {
+                'plone.dexterity': {'model-file-mode': 'production'}
+            }
+            self.assertEqual('production', configured_file_mode())
+
+            configuration.product_config = {
+                'plone.dexterity': {'model-file-mode': 'never'}
+            }
+            self.assertEqual('dev', configured_file_mode())
+        finally:
+            configuration.product_config = product_config
+            configuration.debug_mode = debug_mode
+
     def test_lookupModel_failure(self):
         fti = DexterityFTI(u"testtype")
         fti.schema = None
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+from OFS.SimpleItem import SimpleItem
+from plone.dexterity.content import Container
+from plone.dexterity.namechooser import DexterityNameChooser
+from plone.dexterity.tests.benchmark import measure
+from plone.dexterity.tests.benchmark import report
+from plone.dexterity.tests.benchmark import scale
+from plone.folder.interfaces import IOrdering
+from plone.folder.unordered import UnorderedOrdering
+from plone.i18n.normalizer import URLNormalizer
+from plone.i18n.normalizer.interfaces import IURLNormalizer
+from plone.mocktestcase import MockTestCase
+from zope.component import provideAdapter
+from zope.component import provideUtility
+from zope.interface import Interface
+
+import unittest
+
+
+class CountingNameChooser(DexterityNameChooser):
+
+    checks = 0
+
+    def _getCheckId(self, object):
+        check_id = super(CountingNameChooser, self)._getCheckId(object)
+
+        def counting_check_id(id, required):
+            self.checks += 1
+            return check_id(id, required)
+        return counting_check_id
+
+
+class TestNameChooser(MockTestCase):
+
+    def setUp(self):
+        provideUtility(URLNormalizer(), IURLNormalizer)
+        provideAdapter(UnorderedOrdering, [Interface], IOrdering)
+        self.container = Container('folder')
+        self.container._ordering = u'unordered'
+
+    def add(self, chooser, name):
+        obj = SimpleItem()
+        id = chooser.chooseName(name, obj)
+        self.container._setOb(id, obj)
+        return id
+
+    def test_next_suffix(self):
+        chooser = CountingNameChooser(self.container)
+        self.assertEqual('file.txt', self.add(chooser, u"file.txt"))
+        self.assertEqual('file-1.txt', self.add(chooser, u"file.txt"))
+        self.assertEqual('file-2.txt', self.add(chooser, u"file.txt"))
+        self.assertEqual('file', self.add(chooser, u"file"))
+        self.assertEqual('file-1', self.add(chooser, u"file"))
+
+        # the highest suffix in use is found in the BTree
+        self.container._setOb('report-41', SimpleItem())
+        self.container._setOb('report', SimpleItem())
+        self.assertEqual(
+            'report-42',
+            CountingNameChooser(self.container).chooseName(
+                u"report",
+                SimpleItem()
+            )
+        )
+
+    def test_benchmark_same_title(self):
+        chooser = CountingNameChooser(self.container)
+        items = scale(1000, 100000)
+
+        rate = measure(lambda: self.add(chooser, u"Same title"), items)
+        report(
+            'adding %d items with the same title' % items,
+            items_per_second=int(rate),
+            id_checks=chooser.checks
+        )
+
+        self.assertEqual(items, self.container.objectCount())
+        last = 'same-title-%d' % (items - 1)
+        self.assertTrue(self.container.hasObject(last))
+        # about two id checks per item, not one per existing sibling
+        self.assertTrue(chooser.checks <= 3 * items)
+
+
+def test_suite():
+    return unittest.defaultTestLoader.loadTestsFromName(__name__)
@@ -10,9 +10,15 @@ from plone.dexterity.schema import SCHEMA_CACHE
 from plone.mocktestcase import MockTestCase
 from plone.supermodel.model import Model
 from Products.CMFCore.interfaces import ISiteRoot
+from zope.component import getGlobalSiteManager
+from zope.component.hooks import setHooks
+from zope.component.hooks import setSite
 from zope.interface import Interface
+from zope.interface import implementer
 from zope.interface.interface import InterfaceClass
 
+import gc
+import random
 import unittest
 import zope.schema
 
@@ -150,6 +156,46 @@ class TestSchemaModuleFactory(MockTestCase):
         # Now we get the fields from the FTI's model
         self.assertEqual(('dummy',), tuple(zope.schema.getFieldNames(klass)))
 
+    def test_transient_schema_cache_bounded(self):
+
+        # No IDexterityFTI registered
+        factory = schema.SchemaModuleFactory()
+        cache = factory._transient_SCHEMA_CACHE = schema.TransientSchemaCache(
+            size=2
+        )
+        names = [
+            schema.portalTypeToSchemaName(portal_type, prefix='site')
+            for portal_type in ('type1', 'type2', 'type3')
+        ]
+        klasses = [factory(name, schema.generated) for name in names]
+
+        self.assertEqual(2, len(cache))
+        self.assertEqual(3, cache.created)
+        self.assertEqual(1, cache.evicted)
+        self.assertEqual(names[1:], list(cache.schemata))
+
+        # Names in the table are answered from it
+        self.assertTrue(factory(names[2], schema.generated) is klasses[2])
+        self.assertEqual(1, cache.hits)
+        self.assertEqual(3, cache.created)
+
+        # A retired interface which is still used is not created again
+        self.assertTrue(factory(names[0], schema.generated) is klasses[0])
+        self.assertEqual(3, cache.created)
+
+        # Removing a type in one site retires its names in that site only
+        other = schema.portalTypeToSchemaName('type2', prefix='other')
+        factory(other, schema.generated)
+        cache.evict('type2', 'site')
+        self.assertEqual([names[2], other], list(cache.schemata))
+        self.assertTrue(factory(names[1], schema.generated) is klasses[1])
+
+        # Retired interfaces nobody uses are dropped
+        del klasses[:]
+        gc.collect()
+        self.assertFalse(names[0] in cache)
+        self.assertFalse(names[1] in cache)
+
     def test_portalTypeToSchemaName_with_schema_and_prefix(self):
         self.assertEqual(
             'prefix_0_type_0_schema',
@@ -207,17 +253,79 @@ class TestSchemaModuleFactory(MockTestCase):
             schema.splitSchemaName('prefix_0_type_1_one_2_two')
         )
 
+    def test_schema_name_round_trip(self):
+        # Names must not contain underscores, and a 0 next to an encoded
+        # character is taken for the separator.
+        rnd = random.Random(42)
+        alphabet = u"abcXYZ123456789 .-/"
+        for i in range(1000):
+            prefix, portal_type, schemaName = [
+                u"".join(
+                    rnd.choice(alphabet) for j in range(rnd.randint(1, 12))
+                )
+                for k in range(3)
+            ]
+            name = schema.portalTypeToSchemaName(
+                portal_type,
+                schemaName,
+                prefix
+            )
+            self.assertEqual(
+                (prefix, portal_type, schemaName),
+                schema.splitSchemaName(name)
+            )
+            self.assertEqual(
+                (prefix, portal_type, u""),
+                schema.splitSchemaName(
+                    schema.portalTypeToSchemaName(portal_type, prefix=prefix)
+                )
+            )
+            self.assertEqual(
+                portal_type,
+                schema.schemaNameToPortalType(name)
+            )
+
+    def test_portalTypeToSchemaName_follows_moved_site(self):
+
+        @implementer(ISiteRoot)
+        class DummySite(object):
+            path = ('', 'foo', 'portalid')
+
+            def getPhysicalPath(self):
+                return self.path
+
+            def getSiteManager(self):
+                return getGlobalSiteManager()
+
+        site = DummySite()
+        setSite(site)
+        setHooks()
+        try:
+            for i in range(2):
+                self.assertEqual(
+                    'foo_4_portalid_0_type',
+                    schema.portalTypeToSchemaName('type')
+                )
+
+            # a parent of the site was moved, e.g. by another ZEO client,
+            # so the site itself got no event
+            site.path = ('', 'bar', 'portalid')
+            self.assertEqual(
+                'bar_4_portalid_0_type',
+                schema.portalTypeToSchemaName('type')
+            )
+        finally:
+            setSite(None)
+
     def test_invalidate_cache(self):
         portal_type = u"testtype"
         fti = DexterityFTI(portal_type)
         SCHEMA_CACHE.get(portal_type)
         SCHEMA_CACHE.behavior_schema_interfaces(fti)
-        self.assertIn('_v_schema_behavior_schema_interfaces',
-                      fti.__dict__.keys())
+        self.assertIn('_v_schema_descriptor', fti.__dict__.keys())
 
         invalidate_cache(fti)
-        self.assertNotIn('_v_schema_behavior_schema_interfaces',
-                         fti.__dict__.keys())
+        self.assertNotIn('_v_schema_descriptor', fti.__dict__.keys())
 
 
 def test_suite():
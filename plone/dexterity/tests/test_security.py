@@ -1,12 +1,26 @@
 # -*- coding: utf-8 -*-
+from Acquisition import Implicit
+from plone.autoform.interfaces import IFormFieldProvider
 from plone.autoform.interfaces import READ_PERMISSIONS_KEY
+from plone.behavior.interfaces import IBehaviorAssignable
 from plone.dexterity.content import Item
 from plone.dexterity.content import Container
 from plone.dexterity.fti import DexterityFTI
 from plone.dexterity.interfaces import IDexterityFTI
+from plone.dexterity.interfaces import IMemoizePermissionChecks
 from plone.dexterity.schema import SCHEMA_CACHE
+from plone.dexterity.security import checkPermission
+from plone.dexterity.security import clearPermissionMemo
+from plone.dexterity.security import getPermissionMemo
 from plone.mocktestcase import MockTestCase
+from zope.annotation.attribute import AttributeAnnotations
+from zope.annotation.interfaces import IAttributeAnnotatable
+from zope.component import adapter
+from zope.component import getGlobalSiteManager
+from zope.component import provideAdapter
 from zope.interface import Interface
+from zope.interface import alsoProvides
+from zope.interface import implementer
 from zope.interface import provider
 from zope.security.interfaces import IPermission
 from zope.security.permission import Permission
@@ -417,6 +431,220 @@ class TestAttributeProtection(MockTestCase):
             item.__allow_access_to_unprotected_subobjects__('random', u"stuff")
         )
 
+    def test_read_permission_titles_cached(self):
+
+        # Mock schema model
+        class ITestSchema(Interface):
+            test = zope.schema.TextLine(title=u"Test")
+        ITestSchema.setTaggedValue(
+            READ_PERMISSIONS_KEY,
+            dict(test='foo.View', bar='bar.View')
+        )
+
+        # Mock FTI, looked up once for all checks
+        fti_mock = self.mocker.proxy(DexterityFTI(u"testtype"))
+        self.expect(fti_mock.lookupSchema()).result(ITestSchema)
+        self.expect(fti_mock.behaviors).result(tuple())
+        self.mock_utility(fti_mock, IDexterityFTI, u'testtype')
+
+        # Mock permissions; bar.View is not registered
+        self.mock_utility(
+            Permission(u'foo.View', u"View foo"), IPermission, u'foo.View'
+        )
+
+        # Content item
+        item = Item('test')
+        item.portal_type = u"testtype"
+
+        # Check permission
+        securityManager_mock = self.mocker.mock()
+        self.expect(
+            securityManager_mock.checkPermission("View foo", item)
+        ).result(True).count(3)
+        getSecurityManager_mock = self.mocker.replace(
+            'AccessControl.getSecurityManager'
+        )
+        self.expect(
+            getSecurityManager_mock()
+        ).result(securityManager_mock).count(3)
+
+        self.mocker.replay()
+
+        SCHEMA_CACHE.clear()
+
+        self.assertTrue(
+            item.__allow_access_to_unprotected_subobjects__('test', u"foo")
+        )
+        self.assertEqual(
+            {'test': u"View foo", 'bar': None},
+            SCHEMA_CACHE.descriptor(u'testtype').read_permission_titles
+        )
+
+        # The permission title was resolved once, the utility is not needed
+        # anymore
+        getGlobalSiteManager().unregisterUtility(
+            provided=IPermission,
+            name=u'foo.View'
+        )
+        self.assertTrue(
+            item.__allow_access_to_unprotected_subobjects__('test', u"foo")
+        )
+        self.assertTrue(
+            item.__allow_access_to_unprotected_subobjects__('test', u"foo")
+        )
+
+        # Unknown permissions deny access
+        self.assertFalse(
+            item.__allow_access_to_unprotected_subobjects__('bar', u"baz")
+        )
+
+    def test_dynamic_behaviors(self):
+
+        # Mock schema model
+        class ITestSchema(Interface):
+            test = zope.schema.TextLine(title=u"Test")
+
+        @provider(IFormFieldProvider)
+        class ITestBehavior(Interface):
+            test2 = zope.schema.TextLine(title=u"Test")
+        ITestBehavior.setTaggedValue(
+            READ_PERMISSIONS_KEY,
+            dict(test2='foo.View')
+        )
+
+        # Behaviors bound on the content instead of the FTI
+        class DynamicItem(Item):
+            _dynamic_behaviors = True
+
+        class Registration(object):
+            interface = ITestBehavior
+            marker = None
+
+        @implementer(IBehaviorAssignable)
+        @adapter(DynamicItem)
+        class Assignable(object):
+
+            def __init__(self, context):
+                self.context = context
+
+            def enumerateBehaviors(self):
+                yield Registration()
+
+        self.mock_adapter(Assignable, IBehaviorAssignable, (DynamicItem,))
+
+        # Mock FTI
+        fti_mock = self.mocker.proxy(DexterityFTI(u"testtype"))
+        self.expect(fti_mock.lookupSchema()).result(ITestSchema)
+        self.expect(fti_mock.behaviors).result(tuple()).count(0, None)
+        self.mock_utility(fti_mock, IDexterityFTI, u'testtype')
+
+        # Mock permissions
+        self.mock_utility(
+            Permission(u'foo.View', u"View foo"), IPermission, u'foo.View'
+        )
+
+        # Content item
+        item = DynamicItem('test')
+        item.portal_type = u"testtype"
+
+        # Check permission
+        securityManager_mock = self.mocker.mock()
+        self.expect(
+            securityManager_mock.checkPermission("View foo", item)
+        ).result(False)
+        getSecurityManager_mock = self.mocker.replace(
+            'AccessControl.getSecurityManager'
+        )
+        self.expect(
+            getSecurityManager_mock()
+        ).result(securityManager_mock).count(1)
+
+        self.mocker.replay()
+
+        SCHEMA_CACHE.clear()
+
+        # The behavior of the content is honored, though the FTI has none
+        self.assertFalse(
+            item.__allow_access_to_unprotected_subobjects__('test2', u"foo")
+        )
+        self.assertTrue(
+            item.__allow_access_to_unprotected_subobjects__('test', u"foo")
+        )
+
+    def test_custom_assignable_without_flag(self):
+
+        # Mock schema model
+        class ITestSchema(Interface):
+            test = zope.schema.TextLine(title=u"Test")
+
+        @provider(IFormFieldProvider)
+        class ITestBehavior(Interface):
+            test2 = zope.schema.TextLine(title=u"Test")
+        ITestBehavior.setTaggedValue(
+            READ_PERMISSIONS_KEY,
+            dict(test2='foo.View')
+        )
+
+        # An add-on binds behaviors on the content, but the class does not
+        # set _dynamic_behaviors
+        class CustomItem(Item):
+            pass
+
+        class Registration(object):
+            interface = ITestBehavior
+            marker = None
+
+        @implementer(IBehaviorAssignable)
+        @adapter(CustomItem)
+        class Assignable(object):
+
+            def __init__(self, context):
+                self.context = context
+
+            def enumerateBehaviors(self):
+                yield Registration()
+
+        self.mock_adapter(Assignable, IBehaviorAssignable, (CustomItem,))
+
+        # Mock FTI
+        fti_mock = self.mocker.proxy(DexterityFTI(u"testtype"))
+        self.expect(fti_mock.lookupSchema()).result(ITestSchema)
+        self.expect(fti_mock.behaviors).result(tuple()).count(0, None)
+        self.mock_utility(fti_mock, IDexterityFTI, u'testtype')
+
+        # Mock permissions
+        self.mock_utility(
+            Permission(u'foo.View', u"View foo"), IPermission, u'foo.View'
+        )
+
+        # Content item
+        item = CustomItem('test')
+        item.portal_type = u"testtype"
+
+        # Check permission
+        securityManager_mock = self.mocker.mock()
+        self.expect(
+            securityManager_mock.checkPermission("View foo", item)
+        ).result(False)
+        getSecurityManager_mock = self.mocker.replace(
+            'AccessControl.getSecurityManager'
+        )
+        self.expect(
+            getSecurityManager_mock()
+        ).result(securityManager_mock).count(1)
+
+        self.mocker.replay()
+
+        SCHEMA_CACHE.clear()
+
+        # the read permission of the behavior field is enforced
+        self.assertFalse(
+            item.__allow_access_to_unprotected_subobjects__('test2', u"foo")
+        )
+        self.assertTrue(
+            item.__allow_access_to_unprotected_subobjects__('test', u"foo")
+        )
+
     def test_no_schema(self):
 
         # Mock FTI
@@ -496,5 +724,141 @@ class TestAttributeProtection(MockTestCase):
         )
 
 
+class DummyUser(object):
+
+    def getId(self):
+        return 'user'
+
+
+class DummySecurityManager(object):
+
+    def __init__(self):
+        self.checks = []
+
+    def getUser(self):
+        return DummyUser()
+
+    def checkPermission(self, permission, obj):
+        self.checks.append((permission, obj.getPhysicalPath()))
+        return True
+
+
+class DummyRoot(Implicit):
+
+    def __init__(self, request):
+        self.REQUEST = request
+
+    def getPhysicalPath(self):
+        return ('', )
+
+
+@implementer(IAttributeAnnotatable)
+class DummyRequest(object):
+    pass
+
+
+class TestPermissionMemo(MockTestCase):
+
+    def setUp(self):
+        SCHEMA_CACHE.clear()
+        provideAdapter(AttributeAnnotations)
+
+    def mock_security_manager(self):
+        security_manager = DummySecurityManager()
+        getSecurityManager_mock = self.mocker.replace(
+            'AccessControl.getSecurityManager'
+        )
+        self.expect(
+            getSecurityManager_mock()
+        ).result(security_manager).count(0, None)
+        return security_manager
+
+    def test_not_memoized_by_default(self):
+        security_manager = self.mock_security_manager()
+        self.replay()
+
+        request = DummyRequest()
+        item = Item('test').__of__(DummyRoot(request))
+
+        self.assertTrue(checkPermission('View', item))
+        self.assertTrue(checkPermission('View', item))
+        self.assertEqual(2, len(security_manager.checks))
+        self.assertEqual(None, getPermissionMemo(request))
+
+    def test_memoized_in_request(self):
+        security_manager = self.mock_security_manager()
+        self.replay()
+
+        request = DummyRequest()
+        alsoProvides(request, IMemoizePermissionChecks)
+        root = DummyRoot(request)
+        item1 = Item('item1').__of__(root)
+        item2 = Item('item2').__of__(root)
+
+        for i in range(3):
+            self.assertTrue(checkPermission('View', item1))
+            self.assertTrue(checkPermission('View', item2))
+            self.assertTrue(checkPermission('Modify', item1))
+        self.assertEqual(
+            [
+                ('View', ('', 'item1')),
+                ('View', ('', 'item2')),
+                ('Modify', ('', 'item1')),
+            ],
+            security_manager.checks
+        )
+        self.assertEqual(6, getPermissionMemo(request).saved)
+
+        # e.g. a workflow transition
+        clearPermissionMemo(item1, None)
+        self.assertTrue(checkPermission('View', item2))
+        self.assertEqual(4, len(security_manager.checks))
+        self.assertEqual(6, getPermissionMemo(request).saved)
+
+        # unwrapped objects are not memoized
+        item3 = Item('item3')
+        item3.REQUEST = request
+        self.assertTrue(checkPermission('View', item3))
+        self.assertTrue(checkPermission('View', item3))
+        self.assertEqual(6, len(security_manager.checks))
+
+    def test_attribute_validator_memoized(self):
+
+        # Mock schema model
+        class ITestSchema(Interface):
+            test = zope.schema.TextLine(title=u"Test")
+        ITestSchema.setTaggedValue(READ_PERMISSIONS_KEY, dict(test='foo.View'))
+
+        # Mock FTI
+        fti_mock = self.mocker.proxy(DexterityFTI(u"testtype"))
+        self.expect(fti_mock.lookupSchema()).result(ITestSchema)
+        self.expect(fti_mock.behaviors).result(tuple())
+        self.mock_utility(fti_mock, IDexterityFTI, u'testtype')
+
+        # Mock permissions
+        self.mock_utility(
+            Permission(u'foo.View', u"View foo"), IPermission, u'foo.View'
+        )
+
+        security_manager = self.mock_security_manager()
+        self.replay()
+
+        request = DummyRequest()
+        alsoProvides(request, IMemoizePermissionChecks)
+        item = Item('test')
+        item.portal_type = u"testtype"
+        item = item.__of__(DummyRoot(request))
+
+        for i in range(10):
+            self.assertTrue(
+                item.__allow_access_to_unprotected_subobjects__('test', u"")
+            )
+        self.assertEqual(
+            [('View foo', ('', 'test'))],
+            security_manager.checks
+        )
+        self.assertEqual(9, getPermissionMemo(request).saved)
+
+
 def test_suite():
     return unittest.defaultTestLoader.loadTestsFromName(__name__)
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+from plone.dexterity.fti import DexterityFTI
+from plone.dexterity.fti import MODEL_CACHE
+from plone.dexterity.snapshot import environment_digest
+from plone.dexterity.snapshot import load_snapshot
+from plone.dexterity.snapshot import read_snapshot
+from plone.dexterity.snapshot import write_snapshot
+from plone.mocktestcase import MockTestCase
+from plone.supermodel.model import Model
+from zope import schema
+from zope.interface import Interface
+from zope.interface.interface import InterfaceClass
+
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class TestSnapshot(MockTestCase):
+
+    def setUp(self):
+        MODEL_CACHE.clear()
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, 'schemata.snapshot')
+
+    def tearDown(self):
+        MODEL_CACHE.clear()
+        shutil.rmtree(self.tempdir)
+        super(TestSnapshot, self).tearDown()
+
+    def fti(self, model_source=u"<model />"):
+        fti = DexterityFTI(u"testtype")
+        fti.model_source = model_source
+        fti.behaviors = ('plone.dexterity.tests.IBehavior', )
+        return fti
+
+    def model(self):
+        ISchema = InterfaceClass(
+            'ISchema',
+            (Interface, ),
+            {
+                'title': schema.TextLine(title=u"Title"),
+                'count': schema.Int(title=u"Count", default=3),
+            },
+            __module__='plone.dexterity.schema.transient'
+        )
+        ISchema.setTaggedValue('plone.dexterity.tests.hint', ('title', ))
+        return Model({u"": ISchema})
+
+    def test_roundtrip(self):
+        fti = self.fti()
+
+        # the model is parsed once, when the snapshot is written
+        loadString_mock = self.mocker.replace("plone.supermodel.loadString")
+        self.expect(
+            loadString_mock(u"<model />", policy=u"dexterity")
+        ).result(self.model())
+
+        self.replay()
+
+        self.assertEqual(1, write_snapshot(self.path, [fti]))
+
+        # a new process starts with an empty cache
+        MODEL_CACHE.clear()
+        self.assertEqual(1, load_snapshot(self.path, [fti]))
+
+        model = fti.lookupModel()
+        self.assertEqual(1, MODEL_CACHE.hits)
+        loaded = model.schema
+        self.assertEqual(['count', 'title'], sorted(loaded.names()))
+        self.assertEqual(3, loaded['count'].default)
+        self.assertTrue(loaded['title'].interface is loaded)
+        self.assertEqual(
+            ('title', ),
+            loaded.queryTaggedValue('plone.dexterity.tests.hint')
+        )
+        self.assertEqual(
+            'plone.dexterity.schema.transient',
+            loaded.__module__
+        )
+
+    def test_loaded_models_are_not_evicted_before_use(self):
+        ftis = [self.fti(u"<model />"), self.fti(u"<model>  </model>")]
+
+        loadString_mock = self.mocker.replace("plone.supermodel.loadString")
+        for fti in ftis:
+            self.expect(
+                loadString_mock(fti.model_source, policy=u"dexterity")
+            ).result(self.model())
+
+        self.replay()
+
+        write_snapshot(self.path, ftis)
+
+        # more types than the cache holds
+        MODEL_CACHE.clear()
+        size = MODEL_CACHE.size
+        MODEL_CACHE.size = 1
+        try:
+            self.assertEqual(2, load_snapshot(self.path, ftis))
+            for fti in ftis:
+                self.assertEqual(['count', 'title'], sorted(
+                    fti.lookupModel().schema.names()
+                ))
+        finally:
+            MODEL_CACHE.size = size
+        self.assertEqual(2, MODEL_CACHE.hits)
+        self.assertEqual(0, MODEL_CACHE.misses)
+
+    def test_digest_mismatch_falls_back(self):
+        fti = self.fti()
+
+        loadString_mock = self.mocker.replace("plone.supermodel.loadString")
+        self.expect(
+            loadString_mock(u"<model />", policy=u"dexterity")
+        ).result(self.model())
+
+        self.replay()
+
+        write_snapshot(self.path, [fti])
+        MODEL_CACHE.clear()
+
+        # a changed model or behavior list is not taken from the snapshot
+        self.assertEqual(
+            0,
+            load_snapshot(self.path, [self.fti(u"<model>  </model>")])
+        )
+        changed = self.fti()
+        changed.behaviors = ()
+        self.assertEqual(0, load_snapshot(self.path, [changed]))
+        self.assertEqual(0, MODEL_CACHE.misses)
+        self.assertEqual({}, dict(MODEL_CACHE.models))
+        self.assertEqual({}, MODEL_CACHE.preloaded)
+
+    def test_damaged_snapshot_is_ignored(self):
+        fti = self.fti()
+
+        loadString_mock = self.mocker.replace("plone.supermodel.loadString")
+        self.expect(
+            loadString_mock(u"<model />", policy=u"dexterity")
+        ).result(self.model())
+
+        self.replay()
+
+        write_snapshot(self.path, [fti])
+        self.assertTrue(read_snapshot(self.path))
+
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        with open(self.path, 'wb') as f:
+            f.write(data[:-1] + chr((ord(data[-1]) + 1) % 256))
+        self.assertEqual(None, read_snapshot(self.path))
+
+        with open(self.path, 'wb') as f:
+            f.write(data.replace(' 1 ', ' 0 ', 1))
+        self.assertEqual(None, read_snapshot(self.path))
+
+        # written before a distribution was upgraded
+        digest = environment_digest()
+        with open(self.path, 'wb') as f:
+            f.write(data.replace(digest, '0' * len(digest), 1))
+        self.assertEqual(None, read_snapshot(self.path))
+
+        self.assertEqual(None, read_snapshot(self.path + '.missing'))
+
+
+def test_suite():
+    return unittest.defaultTestLoader.loadTestsFromName(__name__)
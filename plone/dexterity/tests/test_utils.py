@@ -2,7 +2,11 @@
 from pkg_resources import get_distribution
 from plone.dexterity import utils
 from plone.dexterity.fti import DexterityFTI
+from plone.autoform.interfaces import IFormFieldProvider
 from plone.mocktestcase import MockTestCase
+from zope import schema
+from zope.interface import Interface
+from zope.interface import provider
 
 import unittest
 
@@ -10,6 +14,46 @@ import unittest
 has_zope4 = get_distribution('Zope2').version.startswith('4')
 
 
+class DummyCatalog(object):
+
+    def __init__(self):
+        self.indexed = []
+        self.reindexed = []
+
+    def indexObject(self, obj):
+        self.indexed.append(obj.getId())
+
+    def reindexObject(self, obj, idxs=[], update_metadata=1, uid=None):
+        self.reindexed.append(obj.getId())
+
+
+class IRoutingBase(Interface):
+
+    base_field = schema.TextLine(title=u"Inherited field")
+
+
+@provider(IFormFieldProvider)
+class IRoutingBehavior(IRoutingBase):
+
+    own_field = schema.TextLine(title=u"Own field")
+
+
+class RoutingAdapter(object):
+    """Stores the fields of IRoutingBehavior in a dict on the context.
+    """
+
+    def __init__(self, context):
+        self.__dict__['context'] = context
+
+    def __getattr__(self, name):
+        if IRoutingBehavior.get(name) is None:
+            raise AttributeError(name)
+        return self.context.__dict__.get('_routed', {}).get(name)
+
+    def __setattr__(self, name, value):
+        self.context.__dict__.setdefault('_routed', {})[name] = value
+
+
 class TestUtils(MockTestCase):
 
     @unittest.skipIf(has_zope4, 'Broken with zope4, see https://community.plone.org/t/problems-with-mocktestcase-in-plone-dexterity/1484')  # noqa
@@ -43,7 +87,12 @@ class TestUtils(MockTestCase):
             behavior_mock.interface
         ).result(
             IBehaviorInterface
-        ).count(2)
+        ).count(1, None)
+        self.expect(
+            behavior_mock.marker
+        ).result(
+            None
+        ).count(0, None)
 
         provider_mock(IBehaviorInterface)
         self.mocker.result(IBehaviorSchema)
@@ -97,6 +146,343 @@ class TestUtils(MockTestCase):
         item = addContentToContainer(container, item, checkConstraints=False)
         self.assertEqual(item.id, 'foo-1')
 
+    def testAddContentToContainer_returns_stored_object(self):
+        from plone.app.content.namechooser import NormalizingNameChooser
+        from plone.dexterity.content import Container
+        from plone.dexterity.content import Item
+        from plone.dexterity.utils import ADD_CONTENT_STATS
+        from plone.dexterity.utils import addContentToContainer
+        from plone.folder.interfaces import IOrdering
+        from plone.folder.unordered import UnorderedOrdering
+        from plone.i18n.normalizer import URLNormalizer
+        from plone.i18n.normalizer.interfaces import IURLNormalizer
+        from zope.component import provideAdapter
+        from zope.component import provideUtility
+        from zope.container.interfaces import INameChooser
+        from zope.interface import Interface
+        provideAdapter(NormalizingNameChooser, [Interface], INameChooser)
+        provideUtility(URLNormalizer(), IURLNormalizer)
+        provideAdapter(UnorderedOrdering, [Interface], IOrdering)
+
+        class RenamingContainer(Container):
+            # renames new objects, like an event handler could do
+
+            def _setObject(self, id, object, *args, **kw):
+                Container._setObject(self, id, object, *args, **kw)
+                self._delOb(id)
+                object.id = id + '-renamed'
+                self._setOb(object.id, object)
+                return id
+
+        class FailingContainer(Container):
+            # _getOb fails once the new object was added
+
+            added = False
+
+            def _setObject(self, id, object, *args, **kw):
+                id = Container._setObject(self, id, object, *args, **kw)
+                self.added = True
+                return id
+
+            def _getOb(self, id, default=None):
+                if self.added:
+                    raise AttributeError(id)
+                return Container._getOb(self, id, default)
+
+        ADD_CONTENT_STATS.clear()
+
+        container = RenamingContainer('folder')
+        container._ordering = u'unordered'
+        item = Item()
+        item.id = 'foo'
+        added = addContentToContainer(container, item, checkConstraints=False)
+        self.assertEqual('foo-renamed', added.id)
+        self.assertTrue(added.aq_base is item)
+        self.assertTrue(added.aq_parent is container)
+
+        container = FailingContainer('folder')
+        container._ordering = u'unordered'
+        item = Item()
+        item.id = 'foo'
+        added = addContentToContainer(container, item, checkConstraints=False)
+        self.assertTrue(added.aq_base is item)
+        self.assertTrue(added.aq_parent is container)
+
+        # the catalog was not needed
+        self.assertEqual(0, ADD_CONTENT_STATS.catalog_lookups)
+
+    def test_createContentInContainerBulk(self):
+        from plone.app.content.namechooser import NormalizingNameChooser
+        from plone.dexterity.content import Container
+        from plone.dexterity.factory import DexterityFactory
+        from plone.dexterity.interfaces import IDexterityContent
+        from plone.dexterity.interfaces import IDexterityFTI
+        from plone.folder.interfaces import IOrdering
+        from plone.folder.unordered import UnorderedOrdering
+        from plone.i18n.normalizer import URLNormalizer
+        from plone.i18n.normalizer.interfaces import IURLNormalizer
+        from zope.component import provideAdapter
+        from zope.component import provideHandler
+        from zope.component import provideUtility
+        from zope.component.interfaces import IFactory
+        from zope.container.interfaces import INameChooser
+        from zope.interface import Interface
+        from zope.lifecycleevent.interfaces import IObjectAddedEvent
+        provideAdapter(NormalizingNameChooser, [Interface], INameChooser)
+        provideUtility(URLNormalizer(), IURLNormalizer)
+        provideAdapter(UnorderedOrdering, [Interface], IOrdering)
+
+        fti = DexterityFTI(u"testtype")
+        fti.klass = 'plone.dexterity.content.Item'
+        fti.schema = 'plone.dexterity.tests.schemata.ITestSchema'
+        self.mock_utility(fti, IDexterityFTI, name=u"testtype")
+        self.mock_utility(
+            DexterityFactory(u"testtype"),
+            IFactory,
+            name=u"testtype"
+        )
+
+        # like CMF, index content when it is added and again when the
+        # workflow is initialised
+        def added(obj, event):
+            obj.indexObject()
+            obj.reindexObject(idxs=['review_state'])
+        provideHandler(added, (IDexterityContent, IObjectAddedEvent))
+
+        self.replay()
+
+        container = Container()
+        container._ordering = u'unordered'
+        container.portal_catalog = catalog = DummyCatalog()
+
+        created = utils.createContentInContainerBulk(
+            container,
+            u"testtype",
+            [
+                {'id': 'foo', 'title': u"Foo"},
+                {'id': 'foo', 'title': u"Foo"},
+                {'title': u"Bar", 'description': u"Bar description"},
+            ],
+            checkConstraints=False
+        )
+
+        ids = ['foo', 'foo-1', 'testtype']
+        self.assertEqual(ids, [obj.getId() for obj in created])
+        self.assertEqual(ids, sorted(container.objectIds()))
+        self.assertEqual(u"Bar", created[2].title)
+        self.assertEqual(u"Bar description", created[2].description)
+        self.assertTrue(created[0].aq_parent is container)
+
+        # each object is indexed once, after all were added
+        self.assertEqual(ids, catalog.indexed)
+        self.assertEqual([], catalog.reindexed)
+        self.assertFalse(hasattr(created[0], '_v_defer_indexing'))
+
+    def test_createContentInContainerBulk_error(self):
+        from plone.app.content.namechooser import NormalizingNameChooser
+        from plone.dexterity.content import Container
+        from plone.dexterity.factory import DexterityFactory
+        from plone.dexterity.interfaces import IDexterityContent
+        from plone.dexterity.interfaces import IDexterityFTI
+        from plone.folder.interfaces import IOrdering
+        from plone.folder.unordered import UnorderedOrdering
+        from plone.i18n.normalizer import URLNormalizer
+        from plone.i18n.normalizer.interfaces import IURLNormalizer
+        from zope.component import provideAdapter
+        from zope.component import provideHandler
+        from zope.component import provideUtility
+        from zope.component.interfaces import IFactory
+        from zope.container.interfaces import INameChooser
+        from zope.interface import Interface
+        from zope.lifecycleevent.interfaces import IObjectAddedEvent
+        provideAdapter(NormalizingNameChooser, [Interface], INameChooser)
+        provideUtility(URLNormalizer(), IURLNormalizer)
+        provideAdapter(UnorderedOrdering, [Interface], IOrdering)
+
+        fti = DexterityFTI(u"testtype")
+        fti.klass = 'plone.dexterity.content.Item'
+        fti.schema = 'plone.dexterity.tests.schemata.ITestSchema'
+        self.mock_utility(fti, IDexterityFTI, name=u"testtype")
+        self.mock_utility(
+            DexterityFactory(u"testtype"),
+            IFactory,
+            name=u"testtype"
+        )
+
+        # the object loses its volatile attributes, then the handler fails
+        def added(obj, event):
+            del obj._v_defer_indexing
+            raise ValueError(obj.getId())
+        provideHandler(added, (IDexterityContent, IObjectAddedEvent))
+
+        self.replay()
+
+        container = Container()
+        container._ordering = u'unordered'
+
+        # the error of the handler is not hidden
+        self.assertRaises(
+            ValueError,
+            utils.createContentInContainerBulk,
+            container,
+            u"testtype",
+            [{'id': 'foo'}],
+            checkConstraints=False
+        )
+
+    def test_createContentInContainerBulk_indexes_after_error(self):
+        from plone.app.content.namechooser import NormalizingNameChooser
+        from plone.dexterity.content import Container
+        from plone.dexterity.factory import DexterityFactory
+        from plone.dexterity.interfaces import IDexterityContent
+        from plone.dexterity.interfaces import IDexterityFTI
+        from plone.folder.interfaces import IOrdering
+        from plone.folder.unordered import UnorderedOrdering
+        from plone.i18n.normalizer import URLNormalizer
+        from plone.i18n.normalizer.interfaces import IURLNormalizer
+        from zope.component import provideAdapter
+        from zope.component import provideHandler
+        from zope.component import provideUtility
+        from zope.component.interfaces import IFactory
+        from zope.container.interfaces import INameChooser
+        from zope.interface import Interface
+        from zope.lifecycleevent.interfaces import IObjectAddedEvent
+        provideAdapter(NormalizingNameChooser, [Interface], INameChooser)
+        provideUtility(URLNormalizer(), IURLNormalizer)
+        provideAdapter(UnorderedOrdering, [Interface], IOrdering)
+
+        fti = DexterityFTI(u"testtype")
+        fti.klass = 'plone.dexterity.content.Item'
+        fti.schema = 'plone.dexterity.tests.schemata.ITestSchema'
+        self.mock_utility(fti, IDexterityFTI, name=u"testtype")
+        self.mock_utility(
+            DexterityFactory(u"testtype"),
+            IFactory,
+            name=u"testtype"
+        )
+
+        # the handler fails for the second row
+        def added(obj, event):
+            if obj.getId() == 'bar':
+                raise ValueError(obj.getId())
+        provideHandler(added, (IDexterityContent, IObjectAddedEvent))
+
+        self.replay()
+
+        container = Container()
+        container._ordering = u'unordered'
+        container.portal_catalog = catalog = DummyCatalog()
+
+        self.assertRaises(
+            ValueError,
+            utils.createContentInContainerBulk,
+            container,
+            u"testtype",
+            [{'id': 'foo'}, {'id': 'bar'}, {'id': 'baz'}],
+            checkConstraints=False
+        )
+
+        # the object added before stays in the container and is indexed
+        self.assertTrue('foo' in container.objectIds())
+        self.assertEqual(['foo'], catalog.indexed)
+
+    def test_createContent_routes_fields_like_probing(self):
+        from plone.behavior.interfaces import IBehavior
+        from plone.behavior.registration import BehaviorRegistration
+        from plone.dexterity.factory import DexterityFactory
+        from plone.dexterity.interfaces import IDexterityContent
+        from plone.dexterity.interfaces import IDexterityFTI
+        from plone.dexterity.schema import SCHEMA_CACHE
+        from zope.component import createObject
+        from zope.component import provideAdapter
+        from zope.component.interfaces import IFactory
+
+        SCHEMA_CACHE.clear()
+        utils._field_routes.clear()
+
+        registration = BehaviorRegistration(
+            title=u"Routing",
+            description=u"Fields stored by an adapter",
+            interface=IRoutingBehavior,
+            marker=None,
+            factory=RoutingAdapter
+        )
+        self.mock_utility(
+            registration,
+            IBehavior,
+            name=u"plone.dexterity.tests.routing"
+        )
+        provideAdapter(
+            RoutingAdapter,
+            (IDexterityContent, ),
+            IRoutingBehavior
+        )
+
+        # a type with a main schema, which the content provides ...
+        fti = DexterityFTI(u"withschema")
+        fti.klass = 'plone.dexterity.content.Item'
+        fti.schema = 'plone.dexterity.tests.schemata.ITestSchema'
+        fti.behaviors = (u"plone.dexterity.tests.routing", )
+        self.mock_utility(fti, IDexterityFTI, name=u"withschema")
+
+        # ... and one whose fields all come from the behavior adapter
+        fti = DexterityFTI(u"noschema")
+        fti.klass = 'plone.dexterity.content.Item'
+        fti.behaviors = (u"plone.dexterity.tests.routing", )
+        fti_mock = self.mocker.proxy(fti)
+        self.expect(fti_mock.lookupSchema()).throw(ValueError).count(0, None)
+        self.mock_utility(fti_mock, IDexterityFTI, name=u"noschema")
+
+        for portal_type in (u"withschema", u"noschema"):
+            self.mock_utility(
+                DexterityFactory(portal_type),
+                IFactory,
+                name=portal_type
+            )
+
+        self.replay()
+
+        kw = {
+            'id': 'foo',
+            'title': u"Title",
+            'base_field': u"inherited",
+            'own_field': u"own",
+            'other': 1,
+        }
+
+        def state(content):
+            state = dict(content.__dict__)
+            del state['creation_date']
+            del state['modification_date']
+            return state
+
+        for portal_type in (u"withschema", u"noschema"):
+            probed = createObject(portal_type)
+            probed.portal_type = portal_type
+            utils._probeContentFields(
+                probed,
+                list(utils.iterSchemataForType(portal_type)),
+                dict(kw)
+            )
+
+            for i in range(2):
+                routed = utils.createContent(portal_type, **kw)
+                self.assertEqual(state(probed), state(routed))
+
+        # the content answers all fields of its type, so all of them are set
+        # on it when it provides the main schema
+        routed = utils.createContent(u"withschema", **kw)
+        self.assertEqual(u"inherited", routed.__dict__['base_field'])
+        self.assertFalse('_routed' in routed.__dict__)
+
+        routed = utils.createContent(u"noschema", **kw)
+        self.assertEqual(
+            {'base_field': u"inherited", 'own_field': u"own"},
+            routed.__dict__['_routed']
+        )
+        self.assertEqual(u"Title", routed.__dict__['title'])
+        self.assertEqual(1, routed.__dict__['other'])
+
     def test_all_merged_tagged_values_dict(self):
         from zope.interface import Interface
 
@@ -128,6 +514,69 @@ class TestUtils(MockTestCase):
             {'a': 13, 'b': 14}
         )
 
+    def test_resolveDottedName_caches_failures(self):
+        from plone.dexterity.content import Item
+        cache = utils.DottedNameCache()
+
+        resolve_mock = self.mocker.replace("zope.dottedname.resolve.resolve")
+        self.expect(
+            resolve_mock('plone.dexterity.tests.missing.Item')
+        ).throw(ImportError('missing')).count(2)
+        self.expect(
+            resolve_mock('plone.dexterity.content.Item')
+        ).result(Item)
+
+        self.replay()
+
+        for i in range(3):
+            self.assertRaises(
+                ImportError,
+                cache,
+                'plone.dexterity.tests.missing.Item'
+            )
+            self.assertTrue(cache('plone.dexterity.content.Item') is Item)
+
+        # invalidating forgets the failure before it expires
+        cache.invalidate('plone.dexterity.tests.missing.Item')
+        self.assertRaises(
+            ImportError,
+            cache,
+            'plone.dexterity.tests.missing.Item'
+        )
+
+    def test_resolveDottedName_failures_expire(self):
+        cache = utils.DottedNameCache(failure_ttl=-1)
+
+        resolve_mock = self.mocker.replace("zope.dottedname.resolve.resolve")
+        self.expect(
+            resolve_mock('plone.dexterity.tests.missing.Item')
+        ).throw(ImportError('missing')).count(2)
+
+        self.replay()
+
+        for i in range(2):
+            self.assertRaises(
+                ImportError,
+                cache,
+                'plone.dexterity.tests.missing.Item'
+            )
+
+    def test_resolveDottedName_preload(self):
+        from plone.dexterity.content import Item
+        cache = utils.DottedNameCache()
+        fti = DexterityFTI(u"testtype")
+        fti.klass = 'plone.dexterity.content.Item'
+        fti.schema = 'plone.dexterity.tests.missing.ISchema'
+
+        self.assertEqual(
+            ['plone.dexterity.tests.missing.ISchema'],
+            cache.preload([fti])
+        )
+        self.assertTrue(cache.resolved['plone.dexterity.content.Item'] is Item)
+        self.assertTrue(
+            'plone.dexterity.tests.missing.ISchema' in cache.failures
+        )
+
 
 def test_suite():
     return unittest.defaultTestLoader.loadTestsFromName(__name__)
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+from plone.dexterity.content import SPECIFICATION_CACHE
+from plone.dexterity.fti import DexterityFTI
+from plone.dexterity.interfaces import IDexterityFTI
+from plone.dexterity.schema import SCHEMA_CACHE
+from plone.dexterity.schema import schema_generations
+from plone.dexterity.warmup import warmup
+from plone.mocktestcase import MockTestCase
+from zope.annotation.attribute import AttributeAnnotations
+from zope.annotation.interfaces import IAttributeAnnotatable
+from zope.component import getGlobalSiteManager
+from zope.component import provideAdapter
+from zope.interface import Interface
+from zope.interface import implementer
+
+import unittest
+
+
+class TestWarmup(MockTestCase):
+
+    def setUp(self):
+        SCHEMA_CACHE.clear()
+        SPECIFICATION_CACHE.clear()
+
+    def fti(self, portal_type, **kw):
+        fti = DexterityFTI(portal_type)
+        fti.model_source = None
+        for name, value in kw.items():
+            setattr(fti, name, value)
+        return self.mocker.proxy(fti)
+
+    def test_warmup_fills_schema_cache(self):
+
+        class ISchema(Interface):
+            pass
+
+        # FTI mocks: the schema is looked up once, during the warm up
+        fti_mock1 = self.fti(u"testtype1")
+        self.expect(fti_mock1.lookupSchema()).result(ISchema)
+        self.mock_utility(fti_mock1, IDexterityFTI, name=u"testtype1")
+
+        fti_mock2 = self.fti(u"testtype2")
+        self.expect(fti_mock2.lookupSchema()).result(ISchema)
+        self.mock_utility(fti_mock2, IDexterityFTI, name=u"testtype2")
+
+        self.replay()
+
+        timings = warmup()
+
+        self.assertEqual(
+            [u"testtype1", u"testtype2"],
+            sorted(portal_type for elapsed, portal_type in timings)
+        )
+        # the specifications of the default content class are built
+        self.assertEqual(2, SPECIFICATION_CACHE.rebuilds)
+
+        self.assertTrue(SCHEMA_CACHE.get(u"testtype1") is ISchema)
+        self.assertTrue(SCHEMA_CACHE.get(u"testtype2") is ISchema)
+
+    def test_warmup_skips_broken_types(self):
+
+        class ISchema(Interface):
+            pass
+
+        fti_mock1 = self.fti(u"testtype1")
+        self.expect(fti_mock1.lookupSchema()).result(ISchema)
+        self.mock_utility(fti_mock1, IDexterityFTI, name=u"testtype1")
+
+        fti_mock2 = self.fti(
+            u"testtype2",
+            klass='plone.dexterity.tests.nonexisting.Item'
+        )
+        self.mock_utility(fti_mock2, IDexterityFTI, name=u"testtype2")
+
+        self.replay()
+
+        timings = warmup()
+
+        self.assertEqual([u"testtype1"], [pt for elapsed, pt in timings])
+
+    def test_warmup_records_schema_generations(self):
+
+        @implementer(IAttributeAnnotatable)
+        class DummySite(object):
+
+            def getSiteManager(self):
+                return getGlobalSiteManager()
+
+        provideAdapter(AttributeAnnotations)
+        site = DummySite()
+        registry = schema_generations(site, create=True)
+        registry.bump(u"testtype1")
+        SCHEMA_CACHE.synced.clear()
+        SCHEMA_CACHE.synced_counters.clear()
+
+        self.replay()
+
+        warmup(site)
+
+        # the first request only invalidates types changed by another
+        # client after the warm up
+        registry.bump(u"testtype1")
+        self.assertEqual((u"testtype1", ), SCHEMA_CACHE.sync(registry))
+
+
+def test_suite():
+    return unittest.defaultTestLoader.loadTestsFromName(__name__)
@@ -6,6 +6,9 @@ from DateTime import DateTime
 from plone.app.uuid.utils import uuidToObject
 from plone.autoform.interfaces import IFormFieldProvider
 from plone.behavior.interfaces import IBehaviorAssignable
+from plone.dexterity.behavior import DexterityBehaviorAssignable
+from plone.dexterity.behavior import behaviorAssignable
+from plone.dexterity.interfaces import IDexterityContent
 from plone.dexterity.interfaces import IDexterityFTI
 from plone.dexterity.schema import SCHEMA_CACHE
 from plone.dexterity.schema import SchemaNameEncoder  # noqa bbb
@@ -16,16 +19,21 @@ from plone.supermodel.utils import mergedTaggedValueDict
 from plone.uuid.interfaces import IUUID
 from zope import deprecation
 from zope.component import createObject
+from zope.component import getSiteManager
 from zope.component import getUtility
+from zope.component.interfaces import IFactory
 from zope.container.interfaces import INameChooser
 from zope.dottedname.resolve import resolve
 from zope.event import notify
+from zope.interface import providedBy
 from zope.lifecycleevent import ObjectCreatedEvent
 from collective.filepreviewbehavior.events import PreviewableFileCreatedEvent
+from threading import RLock
 
 
 import datetime
 import logging
+import time
 
 deprecation.deprecated(
     'SchemaNameEncoder',
@@ -42,17 +50,88 @@ deprecation.deprecated(
 
 log = logging.getLogger(__name__)
 
-# Not thread safe, but downside of a write conflict is very small
-_dottedCache = {}
+class DottedNameCache(object):
+    """Thread safe cache of resolved dotted names.
+
+    Names which cannot be imported are remembered for ``failure_ttl``
+    seconds, during which resolving them raises the same ImportError again
+    without attempting the import. ``invalidate()`` forgets one or all
+    names, e.g. after fixing the ``klass`` of an FTI.
+    """
+
+    lock = RLock()
+
+    def __init__(self, failure_ttl=60):
+        self.failure_ttl = failure_ttl
+        self.resolved = {}
+        self.failures = {}
+
+    def __call__(self, dottedName):
+        try:
+            return self.resolved[dottedName]
+        except KeyError:
+            pass
+        failure = self.failures.get(dottedName)
+        if failure is not None:
+            error, expires = failure
+            if time.time() < expires:
+                raise error
+        # Importing is done without holding the lock, which could deadlock
+        # with the import lock otherwise.
+        try:
+            obj = resolve(dottedName)
+        except ImportError as error:
+            with self.lock:
+                self.failures[dottedName] = (
+                    error,
+                    time.time() + self.failure_ttl
+                )
+            raise
+        with self.lock:
+            self.resolved[dottedName] = obj
+            self.failures.pop(dottedName, None)
+        return obj
+
+    def invalidate(self, dottedName=None):
+        with self.lock:
+            if dottedName is None:
+                self.resolved.clear()
+                self.failures.clear()
+            else:
+                self.resolved.pop(dottedName, None)
+                self.failures.pop(dottedName, None)
+
+    def preload(self, ftis):
+        """Resolve the klass and schema of the given FTIs.
+
+        Returns the names which cannot be resolved.
+        """
+        failed = []
+        for fti in ftis:
+            for dottedName in (fti.klass, fti.schema):
+                if not dottedName:
+                    continue
+                try:
+                    self(dottedName)
+                except ImportError:
+                    log.warning(
+                        'Cannot resolve %s of type %s',
+                        dottedName,
+                        fti.getId()
+                    )
+                    failed.append(dottedName)
+        return failed
+
+DOTTED_NAME_CACHE = DottedNameCache()
+
+# BBB
+_dottedCache = DOTTED_NAME_CACHE.resolved
 
 
 def resolveDottedName(dottedName):
     """Resolve a dotted name to a real object
     """
-    global _dottedCache
-    if dottedName not in _dottedCache:
-        _dottedCache[dottedName] = resolve(dottedName)
-    return _dottedCache[dottedName]
+    return DOTTED_NAME_CACHE(dottedName)
 
 
 def iterSchemataForType(portal_type):
@@ -95,42 +174,75 @@ def getAdditionalSchemata(context=None, portal_type=None):
               context, portal_type)
     if context is None and portal_type is None:
         return
-    if context:
+    if context and hasDynamicBehaviors(context):
         behavior_assignable = IBehaviorAssignable(context, None)
-    else:
-        behavior_assignable = None
-    if behavior_assignable is None:
-        log.debug("No behavior assignable found, only checking fti.")
-        # Usually an add-form.
-        if portal_type is None:
-            portal_type = context.portal_type
-        for schema_interface in SCHEMA_CACHE.behavior_schema_interfaces(
-            portal_type
-        ):
-            form_schema = IFormFieldProvider(schema_interface, None)
-            if form_schema is not None:
-                yield form_schema
-    else:
-        log.debug("Behavior assignable found for context.")
-        for behavior_reg in behavior_assignable.enumerateBehaviors():
-            form_schema = IFormFieldProvider(behavior_reg.interface, None)
-            if form_schema is not None:
-                yield form_schema
+        if behavior_assignable is not None:
+            log.debug("Behavior assignable found for context.")
+            for behavior_reg in behavior_assignable.enumerateBehaviors():
+                form_schema = IFormFieldProvider(behavior_reg.interface, None)
+                if form_schema is not None:
+                    yield form_schema
+            return
+
+    # The behaviors are the ones enabled in the FTI, so the form field
+    # providers are already known to the schema cache. The stock assignable
+    # of Dexterity content would take them from the context's portal_type.
+    if context is not None and (
+        portal_type is None or IDexterityContent.providedBy(context)
+    ):
+        portal_type = context.portal_type
+    descriptor = SCHEMA_CACHE.descriptor(portal_type)
+    if descriptor is None:
+        return
+    for form_schema in descriptor.form_schemata:
+        yield form_schema
 
 
-def createContent(portal_type, **kw):
-    fti = getUtility(IDexterityFTI, name=portal_type)
-    content = createObject(fti.factory)
+_stock_assignables = (behaviorAssignable, DexterityBehaviorAssignable)
 
-    # Note: The factory may have done this already, but we want to be sure
-    # that the created type has the right portal type. It is possible
-    # to re-define a type through the web that uses the factory from an
-    # existing type, but wants a unique portal_type!
-    content.portal_type = fti.getId()
-    schemas = iterSchemataForType(portal_type)
-    fields = dict(kw)  # create a copy
 
-    for schema in schemas:
+def hasDynamicBehaviors(context, spec=None):
+    """Whether the behaviors of the context may differ from the ones
+    enabled in its FTI, so that the schema information of its type
+    descriptor does not apply to it.
+
+    This is the case if its class sets ``_dynamic_behaviors``, or if
+    another IBehaviorAssignable adapter than the stock one is registered
+    for it, see hasCustomAssignable; spec is the specification to look it
+    up for, by default providedBy(context). Dexterity content keeps the
+    result per type with its shared specification, so that attribute
+    lookups do not ask the component registry.
+    """
+    if getattr(aq_base(context), '_dynamic_behaviors', False):
+        return True
+    if spec is None:
+        spec = providedBy(context)
+    return hasCustomAssignable(spec)
+
+
+def hasCustomAssignable(spec):
+    """Whether another IBehaviorAssignable adapter than the stock one is
+    registered for objects providing spec. The adapter factory is looked
+    up without calling it.
+    """
+    factory = getSiteManager().adapters.lookup((spec, ), IBehaviorAssignable)
+    return factory is not None and factory not in _stock_assignables
+
+
+def getTypeDescriptor(context):
+    """Return the TypeDescriptor of the context's portal_type.
+
+    Returns None if the context has no FTI, or if its behaviors do not come
+    from the FTI, see hasDynamicBehaviors. Callers then have to fall back to
+    iterSchemata(context).
+    """
+    if hasDynamicBehaviors(context):
+        return None
+    return SCHEMA_CACHE.descriptor(context.portal_type)
+
+
+def _probeContentFields(content, schemata, fields):
+    for schema in schemata:
         # schema.names() doesn't return attributes from superclasses in derived
         # schemas. therefore we have to iterate over all items from the passed
         # keywords arguments and set it, if the behavior has the questioned
@@ -149,10 +261,128 @@ def createContent(portal_type, **kw):
     for (key, value) in fields.items():
         setattr(content, key, value)
 
+
+# field name -> (schema, provided by the content) per type descriptor and
+# content class, see _fieldRoutes
+_field_routes = {}
+
+
+def _fieldRoutes(content, descriptor):
+    """Map the field names of the type to the first schema whose adapter
+    has them, as _probeContentFields would find them.
+
+    If the content provides a schema, the adapter is the content itself,
+    which answers all fields of the type with their defaults. Other adapters
+    are expected to have the fields of their schema, including inherited
+    ones. Names which are not fields are not in the map.
+    """
+    key = (descriptor, content.__class__)
+    routes = _field_routes.get(key)
+    if routes is None:
+        routes = {}
+        for schema in descriptor.schemata:
+            if schema.providedBy(content):
+                for name in descriptor.field_names:
+                    routes.setdefault(name, (schema, True))
+            else:
+                for name in schema.names(all=True):
+                    routes.setdefault(name, (schema, False))
+        if len(_field_routes) >= 1000:
+            _field_routes.clear()
+        _field_routes[key] = routes
+    return routes
+
+
+def _setContentFields(content, kw):
+    fields = dict(kw)  # create a copy
+
+    descriptor = SCHEMA_CACHE.descriptor(content.portal_type)
+    if descriptor is None or hasDynamicBehaviors(content):
+        schemata = iterSchemataForType(content.portal_type)
+        _probeContentFields(content, schemata, fields)
+        return
+
+    routes = _fieldRoutes(content, descriptor)
+    adapters = {}
+    for name, value in kw.items():
+        route = routes.get(name)
+        if route is None:
+            continue
+        schema, provided = route
+        if provided:
+            setattr(content, name, value)
+        else:
+            adapter = adapters.get(schema)
+            if adapter is None:
+                adapter = adapters[schema] = schema(content)
+            setattr(adapter, name, value)
+        del fields[name]
+
+    # names which are not fields may still be attributes of an adapter
+    if fields:
+        _probeContentFields(content, descriptor.schemata, fields)
+
+
+def createContent(portal_type, **kw):
+    fti = getUtility(IDexterityFTI, name=portal_type)
+    content = createObject(fti.factory)
+
+    # Note: The factory may have done this already, but we want to be sure
+    # that the created type has the right portal type. It is possible
+    # to re-define a type through the web that uses the factory from an
+    # existing type, but wants a unique portal_type!
+    content.portal_type = fti.getId()
+    _setContentFields(content, kw)
+
     notify(ObjectCreatedEvent(content))
     return content
 
 
+def _checkAddable(container, fti, portal_type):
+    container_fti = container.getTypeInfo()
+
+    if not fti.isConstructionAllowed(container):
+        raise Unauthorized("Cannot create %s" % portal_type)
+
+    if container_fti is not None \
+       and not container_fti.allowType(portal_type):
+        raise ValueError(
+            "Disallowed subobject type: %s" % portal_type
+        )
+
+
+class AddContentStats(object):
+    """Approximate counter of the objects which addContentToContainer could
+    not find in the container after adding them and had to look up in the
+    catalog.
+    """
+
+    def __init__(self):
+        self.catalog_lookups = 0
+
+    def clear(self):
+        self.catalog_lookups = 0
+
+ADD_CONTENT_STATS = AddContentStats()
+
+
+def _storedObject(container, id, object):
+    """The given object as stored in the container under id, wrapped in the
+    container, or None.
+    """
+    if not id:
+        return None
+    base = aq_base(container)
+    tree = getattr(base, '_tree', None)
+    if tree is not None:
+        stored = tree.get(id)
+    else:
+        stored = base.__dict__.get(id)
+    if stored is None or aq_base(stored) is not aq_base(object):
+        return None
+    return aq_base(stored).__of__(container)
+
+
 def addContentToContainer(container, object, checkConstraints=True):
     """Add an object to a container.
 
@@ -165,28 +395,42 @@ def addContentToContainer(container, object, checkConstraints=True):
 
     container = aq_inner(container)
     if checkConstraints:
-        container_fti = container.getTypeInfo()
-
         fti = getUtility(IDexterityFTI, name=object.portal_type)
-        if not fti.isConstructionAllowed(container):
-            raise Unauthorized("Cannot create %s" % object.portal_type)
-
-        if container_fti is not None \
-           and not container_fti.allowType(object.portal_type):
-            raise ValueError(
-                "Disallowed subobject type: %s" % object.portal_type
-            )
+        _checkAddable(container, fti, object.portal_type)
 
     name = getattr(aq_base(object), 'id', None)
     name = INameChooser(container).chooseName(name, object)
     object.id = name
 
     newName = container._setObject(name, object)
+    return _addedObject(container, newName, object)
+
+
+def _addedObject(container, newName, object):
+    """The object just added to the container as newName, wrapped in the
+    container.
+    """
     try:
         return container._getOb(newName)
     except AttributeError:
-        uuid = IUUID(object)
-        return uuidToObject(uuid)
+        pass
+
+    # An event handler may have renamed the object, or _getOb failed for
+    # another reason. Look for the object in the container's storage under
+    # its old and current id before asking the catalog.
+    for id in (newName, getattr(aq_base(object), 'id', None)):
+        stored = _storedObject(container, id, object)
+        if stored is not None:
+            return stored
+
+    ADD_CONTENT_STATS.catalog_lookups += 1
+    log.warning(
+        'Looking up %r added to %r in the catalog',
+        newName,
+        '/'.join(container.getPhysicalPath())
+    )
+    uuid = IUUID(object)
+    return uuidToObject(uuid)
 
 
 def createContentInContainer(container, portal_type, checkConstraints=True,
@@ -203,6 +447,65 @@ def createContentInContainer(container, portal_type, checkConstraints=True,
     return con
 
 
+def createContentInContainerBulk(container, portal_type, rows,
+                                 checkConstraints=True):
+    """Create an object of the given portal_type in the container for each
+    dict of field values in rows, e.g. when importing content.
+
+    This does what createContentInContainer does for each row, but looks up
+    the FTI, factory and name chooser and checks the constraints only once.
+    The new objects are not indexed when events ask for it, but in one pass
+    after all were added, also when a row fails. Returns the new objects,
+    wrapped in the container.
+    """
+    fti = getUtility(IDexterityFTI, name=portal_type)
+    portal_type = fti.getId()
+    container = aq_inner(container)
+    if checkConstraints:
+        _checkAddable(container, fti, portal_type)
+
+    factory = getUtility(IFactory, name=fti.factory)
+    chooser = INameChooser(container)
+
+    created = []
+    deferred = []
+    done = False
+    try:
+        for row in rows:
+            content = factory()
+            content.portal_type = portal_type
+            _setContentFields(content, row)
+            notify(ObjectCreatedEvent(content))
+
+            content._v_defer_indexing = True
+            deferred.append(content)
+            name = getattr(aq_base(content), 'id', None)
+            name = chooser.chooseName(name, content)
+            content.id = name
+            newName = container._setObject(name, content)
+            content = _addedObject(container, newName, content)
+            created.append(content)
+            notify(PreviewableFileCreatedEvent(content))
+        done = True
+    finally:
+        # the flag may be gone already, e.g. if the object was deactivated
+        for content in deferred:
+            aq_base(content).__dict__.pop('_v_defer_indexing', None)
+
+        # The objects added before a failing row stay in the container, and
+        # the caller may catch the error and commit them, so they are
+        # indexed as well. Errors doing so must not hide the original one.
+        for content in created:
+            if done:
+                content.indexObject()
+                continue
+            try:
+                content.indexObject()
+            except Exception:
+                log.exception('Cannot index %r', content.getId())
+    return created
+
+
 def safe_utf8(st):
     if isinstance(st, unicode):
         st = st.encode('utf8')
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""Fill the schema cache at process start, before the first request.
+
+Include ``warmup.zcml`` to warm up all sites when the database is opened,
+or run ``bin/instance dexterity_warmup`` to see the time spent per type.
+
+If a ``schema-snapshot`` path is configured for plone.dexterity in
+zope.conf, the models of TTW types are loaded from that snapshot before the
+warm up and written back to it afterwards, see ``snapshot.py``.
+"""
+from Products.CMFCore.interfaces import ISiteRoot
+from plone.dexterity.content import type_specification
+from plone.dexterity.fti import MODEL_CACHE
+from plone.dexterity.interfaces import IDexterityFTI
+from plone.dexterity.schema import SCHEMA_CACHE
+from plone.dexterity.schema import generated
+from plone.dexterity.schema import portalTypeToSchemaName
+from plone.dexterity.schema import schema_generations
+from plone.dexterity.snapshot import load_snapshot
+from plone.dexterity.snapshot import snapshot_path
+from plone.dexterity.snapshot import write_snapshot
+from plone.dexterity.utils import DOTTED_NAME_CACHE
+from plone.dexterity.utils import resolveDottedName
+from zope.component import getAllUtilitiesRegisteredFor
+from zope.component.hooks import getSite
+from zope.component.hooks import setSite
+from zope.interface import implementedBy
+
+import logging
+import time
+import transaction
+
+log = logging.getLogger(__name__)
+
+
+def warmup_type(fti):
+    """Fill the caches for the type of the given FTI.
+    """
+    portal_type = fti.getId()
+
+    # main schema, behaviors, defaults and permissions
+    descriptor = SCHEMA_CACHE.descriptor(fti)
+
+    # generated interfaces of the other schemata of the model
+    if fti.model_source or fti.model_file:
+        model = fti.lookupModel()
+        for schemaName in sorted(model.schemata):
+            if schemaName:
+                getattr(
+                    generated,
+                    portalTypeToSchemaName(portal_type, schemaName)
+                )
+
+    # specification of the instances
+    if fti.klass:
+        klass = resolveDottedName(fti.klass)
+        if klass is not None:
+            type_specification(descriptor, implementedBy(klass))
+
+
+def warmup(site=None, snapshot=None):
+    """Fill the caches for all Dexterity types of the site.
+
+    Returns a list of (seconds, portal_type) tuples, slowest first. Types
+    which fail are logged and skipped.
+
+    If snapshot is the path of a schema snapshot, the models found in it are
+    used instead of parsing them, and the snapshot is rewritten when any
+    type was missing from it.
+
+    Descriptors are stored on the FTIs of the current ZODB connection;
+    other connections build their own from the warm process wide caches.
+    The schema generations of the site are recorded first, so that the
+    first request only invalidates types changed after the warm up.
+    """
+    old_site = getSite()
+    if site is not None:
+        setSite(site)
+    timings = []
+    try:
+        registry = schema_generations(getSite())
+        if registry is not None:
+            SCHEMA_CACHE.sync(registry)
+        ftis = getAllUtilitiesRegisteredFor(IDexterityFTI)
+        DOTTED_NAME_CACHE.preload(ftis)
+        MODEL_CACHE.reserve(len([fti for fti in ftis if fti.model_source]))
+        if snapshot is not None:
+            loaded = load_snapshot(snapshot, ftis)
+            log.info('Loaded %d models from %s', loaded, snapshot)
+        for fti in ftis:
+            portal_type = fti.getId()
+            start = time.time()
+            try:
+                warmup_type(fti)
+            except Exception:
+                log.exception('Cannot warm up %s', portal_type)
+                continue
+            elapsed = time.time() - start
+            log.info('Warmed up %s in %.3f seconds', portal_type, elapsed)
+            timings.append((elapsed, portal_type))
+        if snapshot is not None and loaded < len(
+            [fti for fti in ftis if fti.model_source]
+        ):
+            write_snapshot(snapshot, ftis)
+    finally:
+        setSite(old_site)
+    timings.sort(reverse=True)
+    return timings
+
+
+def find_sites(app):
+    return [obj for obj in app.objectValues() if ISiteRoot.providedBy(obj)]
+
+
+def warmup_on_database_opened(event):
+    """Warm up all sites in the root of the database.
+    """
+    connection = event.database.open()
+    try:
+        app = connection.root()['Application']
+        snapshot = snapshot_path()
+        for site in find_sites(app):
+            start = time.time()
+            timings = warmup(site, snapshot)
+            log.info(
+                'Warmed up %d types of %s in %.3f seconds',
+                len(timings),
+                site.getId(),
+                time.time() - start
+            )
+    finally:
+        transaction.abort()
+        connection.close()
+
+
+def warmup_command(app, args):
+    """zopectl command: warm up all sites and print the time spent per
+    type, slowest first.
+    """
+    for site in find_sites(app):
+        print('%s:' % site.getId())
+        for elapsed, portal_type in warmup(site):
+            print('  %8.3f s  %s' % (elapsed, portal_type))
+    transaction.abort()
@@ -77,5 +77,7 @@ setup(
     },
     entry_points="""
     # -*- Entry points: -*-
+    [zopectl.command]
+    dexterity_warmup = plone.dexterity.warmup:warmup_command
     """,
 )